@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the loading and the tests of checkETC
+Synthetic data files are generated in a temporary folder, with the shapes described by the header files of headersCriteria:
+    -EC: 10 Hz GL-ZaF_EC_*_L01_F01.zip files, 1 csv file per zip, quoted header line, timestamps without quotes, -9999 as missing value
+    -BM: GL-ZaF_BM_*.dat files of a day at 20 s and 60 s, no header line, quoted timestamps, "NaN" as missing value
+Each function is timed separately, for several numbers of rows and columns. The results are appended to a csv file, 1 row per function and file shape, with the date of the run, so that runs can be compared.
+
+usage: python checkETC_benchmark.py [-r Repeats] [-o FileResults] [--figures]
+"""
+
+import os
+import socket
+import argparse # CLI arguments
+import tempfile
+import shutil
+import time
+import zipfile
+
+import pandas as pd
+from datetime import datetime, timedelta, date
+import numpy as np
+
+import checkETC_v2 as ETC
+
+#data files types: group settings as written in the config file (values quoted as in the config files of the sites), header file of the channels, diagnostic channels kept in every column subset, tested number of rows and number of columns (0: all the channels of the header)
+Types = {
+    'EC': {'Group': {'FILE_TYPE': 'EC', 'Period': 0.1, 'NumberFiles': 48, 'FILE_HEAD_NUM': 1, 'FILE_HEAD_VARS': 1, 'FILE_EXTENSION': '.csv', 'FILE_MISSING_VALUE': '-9999', 'FILE_TIMESTAMP': 'No quotes', 'FILE_COMPRESS': '.zip', 'PlotMaxPoints': ''},
+           'FileHeader': os.path.join('headersCriteria', 'EC', 'GL-ZaF_ECHEADER_202107071330_L01_F01.csv'),
+           'Keep': ['GA_DIAG_CODE'],
+           'Rows': [3000, 18000, 72000],
+           'Columns': [10, 0]},
+    'BM20': {'Group': {'FILE_TYPE': 'BM', 'Period': 20, 'NumberFiles': 1, 'FILE_HEAD_NUM': 0, 'FILE_HEAD_VARS': 0, 'FILE_EXTENSION': '.dat', 'FILE_MISSING_VALUE': '"NaN"', 'FILE_TIMESTAMP': 'Quotes', 'FILE_COMPRESS': '', 'PlotMaxPoints': ''},
+           'FileHeader': os.path.join('headersCriteria', 'met', 'GL-ZaF_BMHEADER_202204261956_L04_F02.csv'),
+           'Keep': [],
+           'Rows': [4320],
+           'Columns': [5, 0]},
+    'BM60': {'Group': {'FILE_TYPE': 'BM', 'Period': 60, 'NumberFiles': 1, 'FILE_HEAD_NUM': 0, 'FILE_HEAD_VARS': 0, 'FILE_EXTENSION': '.dat', 'FILE_MISSING_VALUE': '"NaN"', 'FILE_TIMESTAMP': 'Quotes', 'FILE_COMPRESS': '', 'PlotMaxPoints': ''},
+           'FileHeader': os.path.join('headersCriteria', 'met', 'GL-ZaF_BMHEADER_202107070000_L04_F01.csv'),
+           'Keep': [],
+           'Rows': [1440],
+           'Columns': [5, 0]},
+    }
+
+DateBenchmark = date(2022, 8, 1)
+
+def Benchmark(Repeats=3, FileResults='checkETC_benchmark.csv', Figures=False):
+    #generate the data files, time each function, and append the results to FileResults
+
+    #same working folder as checkETC, for the template of the reports and the diagnostic table
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    FileResults = os.path.abspath(FileResults)
+    Folder = tempfile.mkdtemp(prefix='checkETC_benchmark_')
+
+    ETC.Settings = {'Site': 'Benchmark', 'FolderHTMLReport': Folder, 'FolderHome': Folder, 'FileDiagnostics': 'checkETC_diagnostics.csv', 'Figures': 'always', 'CacheFolder': '', 'PlotMaxPoints': 5000}
+    ETC.InitLogger(os.path.join(Folder, 'BenchmarkLog.txt'))
+    ETC.logger.handlers[0].setLevel(ETC.logging.WARNING) #only the file handler logs the tests
+
+    Run = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    Results = []
+    try:
+        Config = ConfigGroups(Folder)
+        for Type, Spec in Types.items():
+            HeaderAll = pd.read_csv(Spec['FileHeader'], index_col=0)
+            for NbColumns in Spec['Columns']:
+                Header = SubHeader(HeaderAll, NbColumns, Spec['Keep'])
+                Group = Config.loc[Type, :]
+                for NbRows in Spec['Rows']:
+                    print('%s: %d rows, %d columns' % (Type, NbRows, len(Header)))
+                    if Group.FILE_TYPE == 'EC':
+                        File = GenerateEC(Folder, Header, NbRows)
+                    else:
+                        File = GenerateBM(Folder, Header, NbRows, Group.Period)
+                    Shape = {'Run': Run, 'Host': socket.gethostname(), 'Type': Type, 'Rows': NbRows, 'Columns': len(Header)}
+
+                    for Stage, Times in TimeStages(Group, Header, File, Repeats, Figures):
+                        Results.append(Shape | {'Stage': Stage, 'Repeats': len(Times), 'Min (s)': min(Times), 'Median (s)': float(np.median(Times))})
+                    os.remove(File)
+    finally:
+        ETC.logging.shutdown()
+        ETC.logger.removeHandler(ETC.logger.handlers[1])
+        shutil.rmtree(Folder, ignore_errors=True)
+
+    DF_Results = pd.DataFrame(Results)
+    DF_Results['Rows/s'] = (DF_Results.Rows / DF_Results['Median (s)']).round().astype(int)
+    DF_Results.to_csv(FileResults, mode='a', header=not os.path.exists(FileResults), index=False, float_format='%.6g')
+    print(DF_Results.loc[:, ['Type','Rows','Columns','Stage','Min (s)','Median (s)']].to_string(index=False))
+    print('Results added to ' + FileResults)
+    return DF_Results
+
+def ConfigGroups(Folder):
+    #settings of the groups read like in production: the specs of all the types are written in 1 config file, read by LoadConfig (quoting=3, so that "NaN" keeps its quotes)
+    Lines = []
+    for Type, Spec in Types.items():
+        Values = Spec['Group'] | {'FileHeader': Spec['FileHeader'], 'Process': 'TRUE', 'ActiveFrom': DateBenchmark.strftime('%Y%m%d'), 'ActiveTo': ''}
+        Lines.append(Type + ',' + ','.join(str(Value) for Value in Values.values()))
+    FileConfig = os.path.join(Folder, 'Config.csv')
+    with open(FileConfig, 'w') as fid:
+        fid.write('\n'.join(['Group,' + ','.join(Values)] + Lines) + '\n')
+    return ETC.LoadConfig(FileConfig)
+
+def TimeStages(Group, Header, File, Repeats, Figures):
+    #time each function on 1 data file, return a list of (name of the function, list of durations)
+    IsEC = Group.FILE_TYPE == 'EC'
+    Stages = []
+
+    if IsEC:
+        Stages.append(('TestZip', Time(lambda: ETC.TestZip(File, Group.FILE_EXTENSION)[1].close(), Repeats)))
+
+    def Load():
+        ZIP = zipfile.ZipFile(File) if IsEC else None
+        Result = ETC.LoadFile(Group, File, Header, ZIP)
+        if not ZIP is None:
+            ZIP.close()
+        return Result
+    Stages.append(('LoadFile', Time(Load, Repeats)))
+
+    #the tests are performed on the loaded data, as in ProcessFile
+    DF_data, Ok = Load()
+    if not Ok:
+        raise Exception('The file ' + File + ' could not be loaded')
+    DF_data = DF_data.rename(columns=lambda x: x.strip('"'))
+
+    Stages.append(('TimestampIntegrity', Time(lambda: ETC.TimestampIntegrity(DF_data, Group.Period), Repeats)))
+    Timestamps = ETC.TimestampIntegrity(DF_data, Group.Period)
+    Stages.append(('TestGaps', Time(lambda: ETC.TestGaps(Timestamps, Group.Period), Repeats)))
+    Stages.append(('TestNum', Time(lambda: ETC.TestNum(DF_data, Header), Repeats)))
+    Stages.append(('TestNaN', Time(lambda: ETC.TestNaN(DF_data, Header), Repeats)))
+    Stages.append(('TestRange', Time(lambda: ETC.TestRange(DF_data, Header), Repeats)))
+    if IsEC:
+        Stages.append(('TestDiagnosticByte', Time(lambda: ETC.TestDiagnosticByte(DF_data, 'GA_DIAG_CODE'), Repeats)))
+        Stages.append(('TestTimeEC', Time(lambda: ETC.TestTimeEC(Timestamps), Repeats)))
+    if Figures:
+        BaseName = os.path.basename(File)
+        Stages.append(('OutputFigures', Time(lambda: ETC.OutputFigures(DF_data, Header, 'Benchmark', BaseName, DateBenchmark, ETC.PlotMaxPoints(Group)), Repeats)))
+    return Stages
+
+def Time(Function, Repeats):
+    #durations of Repeats calls of Function, each one writing into an empty report fragment
+    Times = []
+    for i in range(Repeats):
+        ETC.Report = ETC.ClassReportFragment()
+        Start = time.perf_counter()
+        Function()
+        Times.append(time.perf_counter() - Start)
+    return Times
+
+#Synthetic data files-------------------------------------------------------------------------------------------------------------------------------
+def SubHeader(Header, NbColumns, Keep):
+    #first NbColumns channels of the header (all if 0), plus the channels listed in Keep
+    if NbColumns == 0 or NbColumns >= len(Header):
+        return Header
+    Channels = Header.index[:NbColumns].tolist()
+    Channels += [Channel for Channel in Keep if not Channel in Channels]
+    return Header.loc[Channels, :]
+
+def GenerateValues(Header, NbRows, Seed=0):
+    #random values within the range of each channel of the header, with a few missing values (NaN) and a few out of range values
+    Rng = np.random.default_rng(Seed)
+    Channels = Header.index[1:]
+    Min = Header.loc[Channels, 'Min'].fillna(-10).to_numpy(float)
+    Max = Header.loc[Channels, 'Max'].fillna(10).to_numpy(float)
+    Values = Min + (Max - Min) * Rng.uniform(0.1, 0.9, (NbRows, len(Channels)))
+    Columns = Rng.integers(0, len(Channels), 10)
+    Values[Rng.integers(0, NbRows, 10), Columns] = Max[Columns] + 1
+    Values[Rng.integers(0, NbRows, 10), Rng.integers(0, len(Channels), 10)] = np.nan
+    DF = pd.DataFrame(Values, columns=Channels)
+    if 'GA_DIAG_CODE' in DF.columns:
+        #nominal diagnostic value, with a few failures
+        DF['GA_DIAG_CODE'] = 8191
+        DF.loc[DF.index[100:110], 'GA_DIAG_CODE'] = 8191 - 64
+    return DF
+
+def GenerateEC(Folder, Header, NbRows):
+    #10 Hz file ending at the end of the day, zipped
+    DateEnd = datetime.combine(DateBenchmark, datetime.min.time()) + timedelta(days=1)
+    Timestamps = pd.date_range(end=DateEnd, periods=NbRows, freq='100ms').strftime('%Y%m%d%H%M%S.%f').str[:-5]
+    Body = GenerateValues(Header, NbRows).to_csv(header=False, index=False, na_rep='-9999', float_format='%.5g', lineterminator='\n').splitlines()
+    Lines = [','.join('"' + Channel + '"' for Channel in Header.index)]
+    Lines += [Timestamp + ',' + Line for Timestamp, Line in zip(Timestamps, Body)]
+
+    Name = 'GL-ZaF_EC_' + DateEnd.strftime('%Y%m%d%H%M') + '_L01_F01'
+    File = os.path.join(Folder, Name + '.zip')
+    with zipfile.ZipFile(File, 'w', zipfile.ZIP_DEFLATED) as ZIP:
+        ZIP.writestr(Name + '.csv', '\n'.join(Lines) + '\n')
+    return File
+
+def GenerateBM(Folder, Header, NbRows, Period):
+    #file of the day, 1 record every Period seconds
+    DateStart = datetime.combine(DateBenchmark, datetime.min.time())
+    Timestamps = pd.date_range(start=DateStart + timedelta(seconds=Period), periods=NbRows, freq=timedelta(seconds=Period)).strftime('"%Y%m%d%H%M%S"')
+    Body = GenerateValues(Header, NbRows).to_csv(header=False, index=False, na_rep='NaN', float_format='%.5g', lineterminator='\n').replace('NaN', '"NaN"').splitlines()
+    Lines = [Timestamp + ',' + Line for Timestamp, Line in zip(Timestamps, Body)]
+
+    File = os.path.join(Folder, 'GL-ZaF_BM_' + DateBenchmark.strftime('%Y%m%d') + '_L04_F0' + str(int(Period/20)) + '.dat')
+    with open(File, 'w') as fid:
+        fid.write('\n'.join(Lines) + '\n')
+    return File
+
+def GetInputArguments():
+    parser = argparse.ArgumentParser(prog='checkETC_benchmark', description='Time the loading and the tests of checkETC on synthetic data files.')
+    parser.add_argument('-r', metavar='Repeats', dest='Repeats', type=int, default=3, help='number of timed calls of each function. Default: 3.')
+    parser.add_argument('-o', metavar='FileResults', dest='FileResults', default='checkETC_benchmark.csv', help='csv file where the results are added. Default: checkETC_benchmark.csv.')
+    parser.add_argument('--figures', dest='Figures', action='store_true', help='also time OutputFigures, the slowest function.')
+    args = parser.parse_args()
+    return args.Repeats, args.FileResults, args.Figures
+
+#Main prog------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    Repeats, FileResults, Figures = GetInputArguments()
+    Benchmark(Repeats, FileResults, Figures)
@@ -23,13 +23,22 @@ todo: read Input Arguments
 """
 
 import os
+import io
+import re
 from glob import glob
-import copy
 from zipfile import ZipFile
 import socket
 import argparse # CLI arguments
 import logging
 import configparser #read INI files
+import pickle
+import hashlib
+import json
+import base64
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 import pandas as pd
 from datetime import datetime, timedelta, date
@@ -37,18 +46,25 @@ import numpy as np
 
 import plotly.graph_objects as go
 import plotly.io as pio
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
 
 pio.templates.default = pio.templates["plotly_dark"]
 
 VerboseLevel = logging.INFO #usually logging.INFO, for debugging logging.DEBUG
+BufferSize = 2**16 #size of the read buffer of data files, must hold the header lines and the first data row
+TimeTolerance = 10**6 #in ns, the steps between records differing from the period by less than TimeTolerance are not gaps (timestamp jitter)
+Timings = [] #durations of the stages of the QC, recorded by ClassTimer
+FileCache = {} #content of the ini, config, header and diagnostic files already loaded by the process, see ReadCached
+FolderIndex = {} #data files of the folders already listed by the process, see ReadFolderIndex
 
-def ListReports(Site, Years=None):
+def ListReports(Site, Years=None, Rebuild=False):
     #Produce a html report per year listing all the daily reports
     #if Years is provided, process the years listed, otherwise process all years present in the report folder
+    #the flags are read from the flag store of the year, updated by QC at the end of each day. If there is no store yet, or if Rebuild is True, the store is built from the Flags.csv files of the day folders
     
     ReadIni(Site)
     
-    FolderHome = Settings['FolderHTMLReport'].split('<')[0]
+    FolderHome = Settings['FolderHome']
     if not os.path.exists(FolderHome):
         os.makedirs(FolderHome)
         
@@ -56,24 +72,25 @@ def ListReports(Site, Years=None):
     InitLogger(os.path.join(FolderHome, 'ListLog.txt'))
     
     if Years is None:
-        #list year folders
-        FoldersYear = sorted(glob(FolderHome + '*\\'))
-    else:
-        if not isinstance(Years, list):
-            Years = [Years]
-        FoldersYear = [os.path.join(FolderHome , str(Year)) for Year in Years]
-    for FolderYear in FoldersYear:
-        Year = os.path.basename(os.path.normpath(FolderYear))
-        #list day folders
-        FoldersDay = sorted(glob(os.path.join(FolderYear, '*\\')))
-        DF_Result = pd.DataFrame()
-        for FolderDay in FoldersDay:
-            FileReport = os.path.join(FolderDay, 'Report.html')
-            FileFlag = os.path.join(FolderDay, 'Flags.csv')
-            if os.path.exists(FileReport) and os.path.exists(FileFlag):
-                DF_Flag = pd.read_csv(FileFlag, index_col=[0])
-                DF_Flag.index = ['<a href="' + FileReport.replace(FolderHome, '') + '">' + DF_Flag.index + '</a>']
-                DF_Result = pd.concat([DF_Result, DF_Flag])
+        #list year folders, and years of the flag stores
+        Years = [os.path.basename(os.path.normpath(FolderYear)) for FolderYear in glob(FolderHome + '*\\')]
+        Years += [os.path.basename(FileStore)[6:10] for FileStore in glob(os.path.join(FolderHome, 'Flags_????.csv'))]
+        Years = sorted(set(Years))
+    elif not isinstance(Years, list):
+        Years = [Years]
+    for Year in Years:
+        Year = str(Year)
+        FileStore = FlagStore(Year)
+        if Rebuild or not os.path.exists(FileStore):
+            BuildFlagStore(Year)
+        else:
+            CompactStore(FileStore, FlagStoreColumns)
+        DF_Result = ReadFlagStore(Year)
+        if Rebuild or not os.path.exists(ChannelStore(Year)):
+            BuildChannelStore(Year)
+        else:
+            CompactStore(ChannelStore(Year), ChannelStoreColumns)
+        DF_Channels = ReadChannelStore(Year)
                 
         Report = ClassReport(FolderHome, Year + '.html', Settings['Site'] + ' ' + Year, '') #HTML report object
         
@@ -82,55 +99,482 @@ def ListReports(Site, Years=None):
         Style.applymap(ColorBool)
         Style.set_table_styles([{'selector': '*', 'props': [('border','1px solid beige')]}])
         Report.Append(Style.to_html(render_links=True))
+        
+        #availability of the channels, per group
+        if not DF_Channels.empty:
+            Report.Append('<h2>Availability of the channels (%)</h2>', False)
+            Report.Append(ChannelHeatmaps(DF_Channels, FolderHome))
         Report.Terminate()
 
-def QC_n(Site, DateStart, DateEnd):
-    for DateQC in [DateStart + timedelta(days=x) for x in range((DateEnd-DateStart).days)]:
-        QC(Site, DateQC)
+#Channel store------------------------------------------------------------------------------------------------------------------------------------------
+#per year, a csv file without header in the report home folder, 1 row per day, group and channel to process, with the statistics of the channel over the day
+#appended, locked, compacted and read like the flag store: a day QC-ed several times is represented by the rows of its latest run. The statistics of each day are also saved in Channels.csv in its folder
+#a csv rather than a columnar file: parquet needs pyarrow, and cannot be appended by parallel QC days
+
+ChannelStoreColumns = ['Date', 'Run', 'Group', 'Channel', 'NbExpected', 'NbRecords', 'NbNaN', 'NbOutRange', 'Min', 'Mean', 'Max']
+
+def ChannelStore(Year):
+    #path of the channel store of a year
+    return os.path.join(Settings['FolderHome'], 'Channels_' + str(Year) + '.csv')
+
+def AppendChannelStore(DateCheck, DF_Channels):
+    #add the statistics of the channels of a QC day to the channel store of its year, under the lock of the store so that parallel QC days do not mix their rows
+    #DF_Channels: statistics of the day, with the columns of the store except Run, or None if the day has no data anymore
+    Run = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    if DF_Channels is None:
+        #a row without group removes the day
+        DF_Store = pd.DataFrame([[DateCheck, Run] + [''] * (len(ChannelStoreColumns) - 2)], columns=ChannelStoreColumns)
+    else:
+        DF_Store = DF_Channels.assign(Run=Run).loc[:, ChannelStoreColumns]
+    FileStore = ChannelStore(DateCheck.year)
+    with ClassFileLock(FileStore), open(FileStore, 'a', newline='') as fid:
+        fid.write(DF_Store.to_csv(header=False, index=False, float_format='%.6g'))
+
+def BuildChannelStore(Year):
+    #build the channel store of a year from the Channels.csv files of the day folders
+    logger.info('Building the channel store of ' + Year + ' from the daily channel files')
+    DF_Days = []
+    for FolderDay in sorted(glob(os.path.join(Settings['FolderHome'], Year, '*\\'))):
+        FileChannels = os.path.join(FolderDay, 'Channels.csv')
+        if os.path.exists(os.path.join(FolderDay, 'Report.html')) and os.path.exists(FileChannels):
+            DF_Days.append(pd.read_csv(FileChannels, dtype={'Date': str}).assign(Run='0'))
+    DF_Store = pd.concat(DF_Days, ignore_index=True) if DF_Days else pd.DataFrame(columns=ChannelStoreColumns)
+    with ClassFileLock(ChannelStore(Year)):
+        DF_Store.loc[:, ChannelStoreColumns].to_csv(ChannelStore(Year), header=False, index=False, float_format='%.6g')
+
+def ReadChannelStore(Year):
+    #load the channel store of a year, keeping the rows of the latest run of each day
+    if os.path.getsize(ChannelStore(Year)) == 0:
+        return pd.DataFrame(columns=ChannelStoreColumns)
+    DF_Store = pd.read_csv(ChannelStore(Year), names=ChannelStoreColumns, dtype={'Date': str, 'Run': str, 'Group': str, 'Channel': str}, keep_default_na=False, na_values=[''])
+    DF_Store = DF_Store.loc[DF_Store.Run == DF_Store.groupby('Date').Run.transform('max'), :]
+    return DF_Store.loc[DF_Store.Group.notnull(), :]
+
+def ChannelHeatmaps(DF_Channels, Folder):
+    #html of the heatmaps of availability of the channels, 1 per group: per channel and day, percentage of valid values over the expected number of records
+    #the hover text shows the percentages of missing values and of values out of range, and the minimum, mean and maximum of the day
+    #Folder: folder of the html file, to link the shared copy of plotly.js
+    Html = ''
+    PlotlyJS = PlotlyAsset(Folder)
+    Days = sorted(pd.unique(DF_Channels.Date))
+    for NameGroup, DF_Group in DF_Channels.groupby('Group', sort=False):
+        NbRecords = DF_Group.NbRecords.where(DF_Group.NbRecords > 0)
+        DF_Group = DF_Group.assign(Availability=(100.0 * (DF_Group.NbRecords - DF_Group.NbNaN) / DF_Group.NbExpected).clip(upper=100),
+                                   NaN=100.0 * DF_Group.NbNaN / NbRecords, OutRange=100.0 * DF_Group.NbOutRange / NbRecords)
+        Channels = pd.unique(DF_Group.Channel)
+        Tables = [DF_Group.pivot(index='Channel', columns='Date', values=Column).reindex(index=Channels, columns=Days) for Column in ['Availability', 'NaN', 'OutRange', 'Min', 'Mean', 'Max']]
+        fig = go.Figure(go.Heatmap(z=Tables[0].to_numpy(), x=Days, y=Channels, zmin=0, zmax=100, colorscale='RdYlGn', customdata=np.stack([Table.to_numpy() for Table in Tables[1:]], axis=-1),
+                                   hovertemplate='%{y} %{x}<br>Available: %{z:.1f} %<br>NaN: %{customdata[0]:.1f} %<br>Out of range: %{customdata[1]:.1f} %<br>Min: %{customdata[2]:.4g}, mean: %{customdata[3]:.4g}, max: %{customdata[4]:.4g}<extra></extra>'))
+        fig.update_layout(title=NameGroup, height=200 + 15*len(Channels), yaxis=dict(autorange='reversed'))
+        Html += fig.to_html(full_html=False, include_plotlyjs=PlotlyJS)
+        PlotlyJS = False
+    return Html
+
+#Flag store--------------------------------------------------------------------------------------------------------------------------------------------
+#per year, a csv file without header in the report home folder, 1 row per day and group: date, QC run, group, flag, relative path of the daily report
+#QC appends the rows of the day at the end of the file. A day QC-ed several times is represented by the rows of its latest run, the rows of the previous runs are removed by CompactStore
+#the QC of parallel days append to the same file: the writes are serialized by a lock file (ClassFileLock)
+
+FlagStoreColumns = ['Date', 'Run', 'Group', 'Flag', 'Report']
+
+def FlagStore(Year):
+    #path of the flag store of a year
+    return os.path.join(Settings['FolderHome'], 'Flags_' + str(Year) + '.csv')
+
+def AppendFlagStore(DateCheck, DF_Flags):
+    #add the flags of a QC day to the flag store of its year, under the lock of the store so that parallel QC days do not mix their rows
+    #DF_Flags: flags of the day (1 row, 1 column per group), or None if the day has no data and no report anymore
+    Run = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    FileReport = os.path.relpath(os.path.join(Settings['FolderHTMLReport'], 'Report.html'), Settings['FolderHome'])
+    if DF_Flags is None:
+        #a row without group removes the day from the yearly report
+        DF_Store = pd.DataFrame([[DateCheck, Run, '', '', '']], columns=FlagStoreColumns)
+    else:
+        DF_Store = pd.DataFrame({'Date': DateCheck, 'Run': Run, 'Group': DF_Flags.columns, 'Flag': DF_Flags.iloc[0,:].values, 'Report': FileReport})
+    FileStore = FlagStore(DateCheck.year)
+    with ClassFileLock(FileStore), open(FileStore, 'a', newline='') as fid:
+        fid.write(DF_Store.to_csv(header=False, index=False))
+
+def BuildFlagStore(Year):
+    #build the flag store of a year from the Flags.csv files of the day folders
+    logger.info('Building the flag store of ' + Year + ' from the daily flag files')
+    FolderHome = Settings['FolderHome']
+    Rows = []
+    for FolderDay in sorted(glob(os.path.join(FolderHome, Year, '*\\'))):
+        FileReport = os.path.join(FolderDay, 'Report.html')
+        FileFlag = os.path.join(FolderDay, 'Flags.csv')
+        if os.path.exists(FileReport) and os.path.exists(FileFlag):
+            DF_Flag = pd.read_csv(FileFlag, index_col=[0])
+            for Group in DF_Flag.columns:
+                Rows.append([DF_Flag.index[0], '0', Group, DF_Flag.iat[0, DF_Flag.columns.get_loc(Group)], os.path.relpath(FileReport, FolderHome)])
+    with ClassFileLock(FlagStore(Year)):
+        pd.DataFrame(Rows, columns=FlagStoreColumns).to_csv(FlagStore(Year), header=False, index=False)
+
+def CompactStore(FileStore, Columns):
+    #rewrite a store (flag or channel store) with only the rows of the latest run of each day, so that it does not grow with the runs of the same days (e.g. in watch mode)
+    #the days removed by their latest run are dropped. The file is rewritten only if some rows are superseded
+    with ClassFileLock(FileStore):
+        if os.path.getsize(FileStore) == 0:
+            return
+        DF_Store = pd.read_csv(FileStore, names=Columns, dtype=str, keep_default_na=False)
+        Kept = (DF_Store.Run == DF_Store.groupby('Date').Run.transform('max')) & (DF_Store.Group != '')
+        if Kept.all():
+            return
+        logger.info('Compacting ' + os.path.basename(FileStore) + ': ' + str((~Kept).sum()) + ' superseded rows removed')
+        DF_Store.loc[Kept, :].to_csv(FileStore + '_', header=False, index=False)
+        os.replace(FileStore + '_', FileStore)
+
+class ClassFileLock():
+    #lock of a file written by several processes, e.g. the stores appended by parallel QC days: a lock file created next to it, only one process can create it at a time
+    #the lock file holds a token of its owner (host, process and a random id), so that a process only removes its own lock
+    #a lock file older than Timeout seconds (the ini setting LockTimeout by default) was left by a killed process, and is removed. The lock is held for an append or a compaction of a store, far shorter
+    def __init__(self, File, Timeout=None):
+        self.FileLock = File + '.lock'
+        self.Timeout = Settings['LockTimeout'] if Timeout is None else Timeout
+        self.Token = socket.gethostname() + ' ' + str(os.getpid()) + ' ' + uuid.uuid4().hex
+    
+    def __enter__(self):
+        while True:
+            try:
+                fid = os.open(self.FileLock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fid, self.Token.encode())
+                os.close(fid)
+                return self
+            except FileExistsError:
+                try:
+                    Owner = self.Owner()
+                    if time.time() - os.path.getmtime(self.FileLock) > self.Timeout and Owner == self.Owner():
+                        #still the same stale lock: not released and taken by another process in the meantime
+                        logger.info('Lock ' + os.path.basename(self.FileLock) + ' of ' + Owner + ' older than ' + str(self.Timeout) + ' s removed')
+                        os.remove(self.FileLock)
+                except FileNotFoundError:
+                    pass #released in the meantime
+                time.sleep(0.05)
+    
+    def __exit__(self, *Exception):
+        try:
+            if self.Owner() == self.Token:
+                os.remove(self.FileLock)
+            else:
+                logger.error('Lock ' + os.path.basename(self.FileLock) + ' was taken over by another process, the writes under the lock may have been concurrent: increase LockTimeout')
+        except FileNotFoundError:
+            logger.error('Lock ' + os.path.basename(self.FileLock) + ' was removed by another process, the writes under the lock may have been concurrent: increase LockTimeout')
+    
+    def Owner(self):
+        #token of the process holding the lock
+        with open(self.FileLock, 'r') as fid:
+            return fid.read()
+
+def ReadFlagStore(Year):
+    #load the flag store of a year as a table: 1 row per day, with a link to its report, 1 column per group
+    DF_Store = pd.read_csv(FlagStore(Year), names=FlagStoreColumns, dtype=str, keep_default_na=False)
+    #keep the rows of the latest run of each day, and drop days without data
+    DF_Store = DF_Store.loc[DF_Store.Run == DF_Store.groupby('Date').Run.transform('max'), :]
+    DF_Store = DF_Store.loc[DF_Store.Group != '', :]
+    
+    Groups = pd.unique(DF_Store.Group)
+    DF_Store = DF_Store.assign(Flag = DF_Store.Flag.map({'True': True, 'False': False}), Link = '<a href="' + DF_Store.Report + '">' + DF_Store.Date + '</a>')
+    DF_Result = DF_Store.pivot(index=['Date', 'Link'], columns='Group', values='Flag').sort_index()
+    DF_Result.index = DF_Result.index.get_level_values('Link')
+    DF_Result.index.name = None
+    DF_Result.columns.name = None
+    return DF_Result.loc[:, Groups]
+
+def Watch(Sites, Interval=60, NbWorkers=1, Delay=2):
+    #QC the files of the present day as they arrive, until interrupted
+    #Sites: a site or a list of sites, watched one after another
+    #every Interval seconds, the files of the day are listed. If some are new or modified, QC of the day is run again in incremental mode: only these files are tested, the results of the other files are reused from the manifest of the day. The yearly report is then updated
+    #after midnight, the previous day is still watched during Delay hours for its last files (e.g. the EC file ending at midnight), and then finalized with a last QC
+    #NbWorkers: number of processes testing the data files in parallel
+    #a day whose files cannot be listed or whose QC fails is logged, and tried again at the next poll
+    
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    if not isinstance(Sites, list):
+        Sites = [Sites]
+    
+    Signatures = {} #per watched site and day, the files found and their sizes and modification times at the last successful QC, None if the last QC failed
+    while True:
+        Now = datetime.now()
+        DaysWatched = [Now.date()]
+        if Now - datetime.combine(Now.date(), datetime.min.time()) < timedelta(hours=Delay):
+            DaysWatched.insert(0, Now.date() - timedelta(days=1))
+        
+        #finalize the days not watched anymore
+        for Site, DateCheck in [Key for Key in Signatures if not Key[1] in DaysWatched]:
+            if WatchQC(Site, DateCheck, NbWorkers, 'Finalizing'):
+                del Signatures[(Site, DateCheck)]
+        
+        for Site in Sites:
+            for DateCheck in DaysWatched:
+                try:
+                    Signature = WatchSignature(Site, DateCheck)
+                except Exception as e:
+                    #e.g. the share of the data files or of the settings is not reachable
+                    WatchError(Site, 'Files not listed for ' + Site + ' ' + DateCheck.strftime('%Y-%m-%d') + ': ' + repr(e))
+                    continue
+                if (Site, DateCheck) in Signatures and Signature == Signatures[(Site, DateCheck)]:
+                    continue
+                if WatchQC(Site, DateCheck, NbWorkers, 'New files for'):
+                    Signatures[(Site, DateCheck)] = Signature
+                else:
+                    Signatures[(Site, DateCheck)] = None
+        
+        time.sleep(Interval)
+
+def WatchSignature(Site, DateCheck):
+    #files of the active groups for a day, with their sizes and modification times
+    ReadIni(Site)
+    Signature = []
+    for NameGroup, Group in ReadCached(Settings['FileConfig'], LoadConfig).iterrows():
+        if IsActive(Group, DateCheck):
+            for File in FindFiles(Group, DateCheck):
+                try:
+                    Stat = os.stat(File)
+                    Signature.append((File, Stat.st_size, Stat.st_mtime_ns))
+                except FileNotFoundError:
+                    pass #removed in the meantime
+    return Signature
+
+def WatchQC(Site, DateCheck, NbWorkers, Text):
+    #incremental QC of a day, and update of the yearly report. A failure is logged and does not stop watching. Return True if the QC and the report succeeded
+    #the events of the watch are added to WatchLog.txt in the report home folder of the site, the QC of the day has its own log
+    try:
+        WatchLogger(Site)
+        logger.info(Text + ' ' + Site + ' ' + DateCheck.strftime('%Y-%m-%d'))
+        QC(Site, DateCheck, NbWorkers, Incremental=True)
+        ListReports(Site, DateCheck.year)
+        return True
+    except Exception as e:
+        WatchError(Site, 'QC failed for ' + Site + ' ' + DateCheck.strftime('%Y-%m-%d') + ': ' + repr(e))
+        return False
+
+def WatchError(Site, Text):
+    #log an error of the watch into the watch log of a site, or into the current log if the report home folder of the site cannot be reached
+    try:
+        WatchLogger(Site)
+    except Exception:
+        pass
+    logging.error(Text)
+
+def WatchLogger(Site):
+    #log into the watch log of a site
+    ReadIni(Site)
+    os.makedirs(Settings['FolderHome'], exist_ok=True)
+    InitLogger(os.path.join(Settings['FolderHome'], 'WatchLog.txt'), 'a')
+
+def QC_n(Site, DateStart, DateEnd, NbWorkers=1):
+    #perform QC for all days from DateStart to DateEnd, both included
+    #NbWorkers: number of processes QC-ing days in parallel, 1 to process the days one after another
+    #a failure on one day is logged and does not stop the other days. Return the list of failed days
+    return [DateQC for SiteQC, DateQC in QC_Sites([Site], DateStart, DateEnd, NbWorkers)]
+
+def QC_Sites(Sites, DateStart, DateEnd, NbWorkers=1):
+    #perform QC for several sites, for all days from DateStart to DateEnd, both included
+    #the QC of each site and day is a task of a single scheduler: with NbWorkers > 1, the tasks of all the sites are spread over 1 pool of worker processes
+    #the settings files and folder indexes are cached per process (see ReadCached), so they are shared by the tasks of all the sites run by a process
+    #the reports and logs of each site and day are written in their own report folder
+    #a failure on one task is logged and does not stop the other tasks. Return the list of failed (site, day)
+    DatesQC = [DateStart + timedelta(days=x) for x in range((DateEnd-DateStart).days + 1)]
+    #the sites progress together, day by day
+    Tasks = [(Site, DateQC) for DateQC in DatesQC for Site in Sites]
+    TasksFailed = []
+
+    if NbWorkers > 1:
+        #each worker process has its own Settings, Report and logger, so the tasks do not interfere
+        with ProcessPoolExecutor(max_workers=NbWorkers) as Pool:
+            Futures = {Pool.submit(QC, Site, DateQC): (Site, DateQC) for Site, DateQC in Tasks}
+            for Future in as_completed(Futures):
+                try:
+                    Future.result()
+                except Exception as e:
+                    TasksFailed.append(Futures[Future])
+                    logging.error('QC failed for ' + Futures[Future][0] + ' ' + Futures[Future][1].strftime('%Y-%m-%d') + ': ' + repr(e))
+    else:
+        for Site, DateQC in Tasks:
+            try:
+                QC(Site, DateQC)
+            except Exception as e:
+                TasksFailed.append((Site, DateQC))
+                logging.error('QC failed for ' + Site + ' ' + DateQC.strftime('%Y-%m-%d') + ': ' + repr(e))
+
+    return sorted(TasksFailed)
+
+def Triage(Site, DateStart, DateEnd=None):
+    #fast check of the data files of the days from DateStart to DateEnd, both included, without parsing them: number of files per group, size of each file against the typical size of its group,
+    #name of the member of zip files (TestZip), and timestamp of the last record, read at the end of the file (or of the zip member)
+    #the typical size of a group is taken from the config file (optional column TypicalSize), or else learned by a triage: the median size of the files passing the other checks, kept in the report home folder
+    #the results are saved per day and group in Triage_<DateStart>_<DateEnd>.csv in the report home folder. Return the list of suspicious days, to QC fully
+    global Report
+    
+    if DateEnd is None:
+        DateEnd = DateStart
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    ReadIni(Site)
+    FolderHome = Settings['FolderHome']
+    if not os.path.exists(FolderHome):
+        os.makedirs(FolderHome)
+    InitLogger(os.path.join(FolderHome, 'TriageLog.txt'))
+    Config = ReadCached(Settings['FileConfig'], LoadConfig)
+    Report = ClassReportFragment() #the text of TestZip is not kept
+    
+    #test the files
+    Rows = []
+    for DateCheck in [DateStart + timedelta(days=x) for x in range((DateEnd-DateStart).days + 1)]:
+        for NameGroup, Group in Config.iterrows():
+            if not IsActive(Group, DateCheck):
+                continue
+            Files = FindFiles(Group, DateCheck)
+            Rows.append({'Date': DateCheck, 'Group': NameGroup, 'File': '', 'NumberFiles': len(Files), 'Size': np.nan, 'OkZip': np.nan, 'OkLast': np.nan})
+            for File in Files:
+                Row = {'Date': DateCheck, 'Group': NameGroup, 'File': File, 'Size': os.path.getsize(File), 'OkZip': np.nan, 'OkLast': np.nan}
+                ZIP = None
+                if Group.FILE_COMPRESS == '.zip':
+                    Row['OkZip'], ZIP = TestZip(File, Group.FILE_EXTENSION)
+                if Settings['TriageLastRecord'] and (ZIP is None) == (Group.FILE_COMPRESS != '.zip'):
+                    if 'EC' == Group['FILE_TYPE']:
+                        DateFile = FileName2Date(os.path.basename(File))
+                    else:
+                        DateFile = datetime.combine(DateCheck, datetime.min.time()) + timedelta(days=1)
+                    try:
+                        #same acceptance as TestDates
+                        Row['OkLast'] = abs((DateFile - LastRecord(Group, File, ZIP)).total_seconds()) <= 0.5
+                    except Exception as e:
+                        logger.info('Last record of ' + os.path.basename(File) + ' not read: ' + str(e))
+                        Row['OkLast'] = False
+                if not ZIP is None:
+                    ZIP.close()
+                Rows.append(Row)
+    DF_Files = pd.DataFrame(Rows, columns=['Date', 'Group', 'File', 'NumberFiles', 'Size', 'OkZip', 'OkLast'])
+    
+    #compare the sizes to the typical sizes of the groups. A size is learned only for the groups without one yet, from at least 10 files with a valid zip and last record,
+    #and is not replaced by the next triages: a batch of truncated or bloated files cannot teach itself that its size is normal
+    Sizes = ReadTypicalSizes()
+    IsFile = DF_Files.File != ''
+    IsClean = IsFile & (DF_Files.OkZip != False) & (DF_Files.OkLast != False)
+    Learned = DF_Files.loc[IsClean, :].groupby('Group').Size.agg(['median', 'count'])
+    Learned = {NameGroup: Size for NameGroup, Size in Learned.loc[Learned['count'] >= 10, 'median'].items() if not NameGroup in Sizes}
+    if Learned:
+        Sizes.update(Learned)
+        WriteTypicalSizes(Sizes)
+    if 'TypicalSize' in Config.columns:
+        Sizes.update(pd.to_numeric(Config.TypicalSize, errors='coerce').dropna().to_dict())
+    for NameGroup in pd.unique(DF_Files.loc[IsFile, 'Group']):
+        if not NameGroup in Sizes:
+            logger.info('No typical size for ' + NameGroup + ' (column TypicalSize of the config file, or learned from 10 files): the sizes of its files are not checked')
+    Typical = DF_Files.Group.map(Sizes)
+    DF_Files['OkSize'] = ((DF_Files.Size / Typical - 1).abs() <= Settings['TriageSizeTolerance']).where(IsFile & Typical.notnull())
+    
+    #results per day and group: the counts of failing files, and the days to QC fully
+    Expected = DF_Files.Group.map(Config.NumberFiles)
+    DF_Files['OkNumberFile'] = (DF_Files.NumberFiles == Expected).where(~IsFile)
+    DF_Triage = DF_Files.groupby(['Date', 'Group'], sort=False).agg(NumberFiles=('NumberFiles', 'sum'), OkNumberFile=('OkNumberFile', 'first'), NbBadSize=('OkSize', lambda Ok: (Ok == False).sum()),
+                                                                    NbBadZip=('OkZip', lambda Ok: (Ok == False).sum()), NbBadLast=('OkLast', lambda Ok: (Ok == False).sum())).reset_index()
+    DF_Triage['NumberFiles'] = DF_Triage.NumberFiles.astype(int)
+    DF_Triage['Suspicious'] = ~DF_Triage.OkNumberFile.astype(bool) | (DF_Triage[['NbBadSize', 'NbBadZip', 'NbBadLast']].sum(axis=1) > 0)
+    DF_Triage.to_csv(os.path.join(FolderHome, 'Triage_' + DateStart.strftime('%Y-%m-%d') + '_' + DateEnd.strftime('%Y-%m-%d') + '.csv'), index=False)
+    
+    DatesSuspicious = sorted(pd.unique(DF_Triage.loc[DF_Triage.Suspicious, 'Date']))
+    for DateCheck in DatesSuspicious:
+        Groups = DF_Triage.loc[DF_Triage.Suspicious & (DF_Triage.Date == DateCheck), 'Group']
+        logger.info('Suspicious ' + DateCheck.strftime('%Y-%m-%d') + ', to QC fully: ' + ', '.join(Groups))
+    logger.info('Triage done: ' + str(len(DatesSuspicious)) + ' suspicious days out of ' + str((DateEnd-DateStart).days + 1))
+    logging.shutdown()
+    return DatesSuspicious
 
-def QC(Site, DateCheck = None):
+def LastRecord(Group, File, ZIP=None):
+    #timestamp of the last record of a data file, read at the end of the file without parsing the file
+    #for zip files, the member is decompressed up to its end, but not parsed
+    with OpenDataFile(File, ZIP) as Stream:
+        Options, DateFormat = ReadOptions(Group, ReadHeader(Group['FileHeader']), Stream)
+        Size = os.path.getsize(File) if ZIP is None else ZIP.infolist()[0].file_size
+        Stream.seek(max(Size - BufferSize, 0))
+        Line = Stream.read().rstrip().rsplit(b'\n', 1)[-1].decode('utf-8', errors='replace')
+    return datetime.strptime(Line.split(',')[0].strip(), DateFormat)
+
+def ReadTypicalSizes():
+    #typical size of the files per group, learned by the previous triages
+    FileSizes = os.path.join(Settings['FolderHome'], 'TypicalSizes.csv')
+    if os.path.exists(FileSizes):
+        return pd.read_csv(FileSizes, index_col=0).Size.to_dict()
+    else:
+        return {}
+
+def WriteTypicalSizes(Sizes):
+    FileSizes = os.path.join(Settings['FolderHome'], 'TypicalSizes.csv')
+    pd.Series(Sizes, name='Size', dtype=float).rename_axis('Group').to_csv(FileSizes)
+
+def QC(Site, DateCheck = None, NbWorkers=1, Incremental=None):
     #Main function to call to perform QC
     #DateCheck: date to QC. If no date specified, today is used
+    #NbWorkers: number of processes testing the data files of the day in parallel, 1 to test the files one after another
+    #Incremental: True or False to override the Incremental setting of the ini file
     
     global Settings, Report
     
     if DateCheck == None:
         DateCheck = date.today()
 
-    Init(Site, DateCheck)
+    Init(Site, DateCheck, Incremental)
     Report = ClassReport(Settings['FolderHTMLReport'], 'Report.html', Settings['Site'] + ' ' + DateCheck.strftime('%Y-%m-%d'), '') #HTML report object
     Report.Append('<h2>Summary</h2>', False)
-    Report.Append('***SUMMARY***', False)
+    Report.AddSlot('Summary')
     DF_ResultGroup = pd.DataFrame() #result table per group
     DF_Result = pd.DataFrame() #result table per file
 
-    NumberFilesTotal = 0
-    for NameGroup, Group in Settings['Config'].iterrows(): #loop through data groups
-        #check if we should process it based on Process flag, and Active dates of the group
-        if Group['Process'] and (Group['ActiveFrom']<=DateCheck) and (pd.isnull(Group['ActiveTo']) or (DateCheck<=Group['ActiveTo'])):
-            Result = {}
-            
-            #retrieve the expected header
-            Header = pd.read_csv(Group['FileHeader'], index_col=0)
-            
-            IsBM = 'BM' == Group['FILE_TYPE']
-            IsEC = 'EC' == Group['FILE_TYPE']
+    #files already tested by a previous QC of the day, with their results
+    Manifest = ReadManifest(Settings['FolderHTMLReport'])
+    Timings.clear()
+    
+    #the files are tested by ProcessFile, either in this process or in a pool of worker processes.
+    #Each file produces its own report fragment, stitched in the report below in the order of the groups and files
+    if NbWorkers > 1:
+        Pool = ProcessPoolExecutor(max_workers=NbWorkers, initializer=InitWorker, initargs=(Settings,))
+    else:
+        Pool = None
+    
+    #the workers and the prefetcher are stopped whatever happens, so that a failed QC (e.g. in watch mode) does not leave its processes, threads and files read ahead behind
+    Prefetcher = None
+    try:
+        #first submit the files of all the groups, so that the workers are kept busy across groups
+        Groups = []
+        for NameGroup, Group in Settings['Config'].iterrows(): #loop through data groups
+            #check if we should process it based on Process flag, and Active dates of the group
+            if IsActive(Group, DateCheck):
+                #retrieve the expected header
+                Header = ReadHeader(Group['FileHeader'])
             
-            #retrieve the files matching the group file mask for the date we are processing
-            PathMask = os.path.join(Group['Folder'], Group['FileMask'])
-            PathMask = PathMask.replace('<YYYY>', Settings['Year'])
-            PathMask = PathMask.replace('<MM>', Settings['Month'])
-            PathMask = PathMask.replace('<DD>', Settings['Day'])
-            Files = sorted(glob(PathMask))
-            if IsEC:
-                #for EC files, we cannot use file names because the 30m-file ending at midnight is actually from the day before, so we use a filter based on datetime
-                DateStart = datetime.combine(DateCheck, datetime.min.time())
-                DateEnd = datetime.combine(DateCheck, datetime.min.time()) + timedelta(days=1)
-                DateFiles = [FileName2Date(os.path.basename(File)) for File in Files]
-                Files = [Files[Index] for Index, DateFile in enumerate(DateFiles) if ((DateStart<DateFile)and(DateFile<=DateEnd))]
+                #retrieve the files matching the group file mask for the date we are processing
+                with ClassTimer('FindFiles', Group=NameGroup) as Timer:
+                    Files = FindFiles(Group, DateCheck)
+                    Timer.Rows = len(Files)
             
+                #Outputs: per file, the output of ProcessFile reused from the manifest, or the future of a worker, or None if the file is tested below
+                Criteria = CriteriaVersion(Group)
+                Outputs = []
+                for File in Files:
+                    Identity = FileIdentity(File, Settings['ManifestHash'])
+                    Entry = Manifest.get(File)
+                    if Settings['Incremental'] and IsUnchanged(Entry, Identity, Criteria):
+                        logger.info('Unchanged ' + NameGroup + '\\' + os.path.basename(File) + ', results of the previous QC reused')
+                        Output = (Entry['Result'], Entry['Fragment'], [], [], Entry.get('DayData'), Entry.get('ChannelStats'))
+                    else:
+                        #the pages of figures of the previous QC are removed, the file may not get new ones
+                        if File in Manifest:
+                            RemoveFigurePages(Settings['FolderHTMLReport'], NameGroup, File)
+                        Output = None if Pool is None else Pool.submit(ProcessFile, Group, Header, NameGroup, File, DateCheck)
+                    Outputs.append((File, Identity, Output))
+                Groups.append((NameGroup, Group, Header, Criteria, Outputs))
+    
+        #the files tested in this process are read ahead by background threads, while the previous files are tested
+        if Pool is None and Settings['PrefetchFiles'] > 0:
+            Prefetcher = ClassPrefetcher([(File, Identity['Size']) for NameGroup, Group, Header, Criteria, Outputs in Groups for File, Identity, Output in Outputs if Output is None], Settings['PrefetchFiles'], Settings['PrefetchMB'] * 2**20)
+    
+        NumberFilesTotal = 0
+        ManifestNew = {}
+        DF_Channels = [] #per group, the statistics of its channels over the day
+        for NameGroup, Group, Header, Criteria, Outputs in Groups:
             #check the number of files
-            NumberFiles = len(Files)
+            NumberFiles = len(Outputs)
             NumberFilesTotal += NumberFiles
             OkNbFiles = NumberFiles == Group['NumberFiles']
             if OkNbFiles:
@@ -138,71 +582,69 @@ def QC(Site, DateCheck = None):
             else:
                 Report.Append('<h2>' + NameGroup + ': detected files: ' + '<span style="color: rgb(255,0,0);">' + str(NumberFiles) + '/' + str(Group['NumberFiles']) + '</span>' + '</h2>', False) #show numbers in red
 
-            if Files:
-                for File in Files: #loop through the data files
-                    BaseName = os.path.basename(File)
-                    logger.info('Process ' + NameGroup + '\\' + BaseName)
-                    Link = '<a href="' + NameGroup + '_' + BaseName + '.html">' + BaseName + '</a>'
-                    Report.Append('<h3>' + Link + '</h3>', False)
-                    
-                    Result['OkImportation'] = True
-                    if Group.FILE_COMPRESS == '.zip':
-                        Result['OkImportation'] = TestZip(File, Group.FILE_EXTENSION)
-                    
-                    if Result['OkImportation']:
-                        DF_data, Result['OkImportation'] = LoadFile(Group, File, Header)
+            ResultGroup = {'Group':NameGroup, 'OkNumberFile':OkNbFiles, 'NumberFile':str(NumberFiles) + '/' + str(Group['NumberFiles'])}
+            ChannelStats = [] #per file, the statistics of its channels
+            if Outputs:
+                DayData = [] #per file, the timestamps and the chosen channels for the whole day analysis
+                for File, Identity, Output in Outputs: #loop through the data files
+                    if Output is None:
+                        Content = None if Prefetcher is None else Prefetcher.Get(File)
+                        Result, Fragment, LogRecords, FileTimings, FileDayData, FileChannels = ProcessFile(Group, Header, NameGroup, File, DateCheck, Content)
+                    elif isinstance(Output, tuple):
+                        Result, Fragment, LogRecords, FileTimings, FileDayData, FileChannels = Output
+                    else:
+                        Result, Fragment, LogRecords, FileTimings, FileDayData, FileChannels = Output.result()
+                        #replay the log of the worker in the log of the day
+                        for LogRecord in LogRecords:
+                            logger.handle(LogRecord)
+                    Report.Append(Fragment, False)
+                    Timings.extend([Timing | {'Group': NameGroup, 'File': os.path.basename(File)} for Timing in FileTimings])
+                    ManifestNew[File] = Identity | {'Criteria': Criteria, 'Result': Result, 'Fragment': Fragment, 'DayData': FileDayData, 'ChannelStats': FileChannels}
+                    DayData.append((os.path.basename(File), FileDayData))
+                    ChannelStats.append(FileChannels)
                         
-                        #perform tests---------------------------------------------------------------
-                        if Result['OkImportation']:
-                            #test if corrupted file, missing columns, or some fields empty
-                            Result['OkMissing'] = (DF_data != '').all(None)
-                            if Result['OkMissing']:
-                                #test header
-                                Result['OkHeader'] = TestHeader(DF_data, Group.FILE_HEAD_VARS, Header.index.tolist())
-                                DF_data = DF_data.rename(columns=lambda x: x.strip('"'))
-                                Result['OkNbColumns'] = TestNbColumns(DF_data)
-                                if IsEC:
-                                    Result['OkDiagnosticByte'] = TestDiagnosticByte(DF_data, 'GA_DIAG_CODE')
-                                    Result['OkTimeEC'] = TestTimeEC(DF_data)
-                                    #Result['OkDiagnosticByte2'] = TestDiagnosticByte2(DF_data, 'Diagnostic Value 2')
-                                    #Result[''] = TestDiagnosticByteCH4(DF_data)
-                                    DateFile = FileName2Date(BaseName)
-                                elif IsBM:
-                                    DateFile = datetime.combine(DateCheck, datetime.min.time()) + timedelta(days=1)
-                                    
-                                Result['OkDates'] = TestDates(DF_data, DateFile, 0.5)
-                                Result['OkNbRecords'] = TestNbRecords(DF_data, int(24*60*60 / Group['NumberFiles'] / Group['Period']))
-                                Result['OkGaps'] = TestGaps(DF_data, Group['Period'])
-                                Result['OkNum'] = TestNum(DF_data, Header)
-                                if Result['OkNum']:
-                                    Result['Oknan'] = TestNaN(DF_data, Header)
-                                    Result['OkRange'], NbOutRange = TestRange(DF_data, Header)
-                                    OutputFigures(DF_data, Header, NameGroup, BaseName, DateCheck)
-                            
                     #add file result to all the results
                     DF_Result = pd.concat([DF_Result,
-                                          pd.DataFrame({'Group':NameGroup , 'Name':Link} | Result, index=[0]).astype(object)],
+                                          pd.DataFrame(Result, index=[0]).astype(object)],
                                           ignore_index=True)
-                
-                OkData = DF_Result.loc[DF_Result.Group == NameGroup, [x for x in DF_Result.columns.tolist() if x[0:2]=='Ok']].all(None)
-            else:
-                OkData = np.nan
             
+                ResultGroup['OkData'] = DF_Result.loc[DF_Result.Group == NameGroup, [x for x in DF_Result.columns.tolist() if x[0:2]=='Ok']].all(None)
+            
+                #EC files: analysis of the whole day, across the boundaries between files
+                if Settings['WholeDayEC'] and 'EC' == Group['FILE_TYPE']:
+                    with ClassTimer('TestWholeDay', Group=NameGroup) as Timer:
+                        Report.Append('<h3>' + NameGroup + ': whole day</h3>', False)
+                        ResultGroup['OkDay'], Completeness = TestWholeDay(DayData, Group['Period'], DateCheck)
+                        ResultGroup['Completeness'] = '%0.2f %%' % (100.0*Completeness)
+                        Timer.Rows = round(Completeness*24*60*60/Group['Period'])
+            else:
+                ResultGroup['OkData'] = np.nan
+            DF_Channels.append(DayChannelStats(Header, Group['Period'], ChannelStats).assign(Group=NameGroup))
+        
             DF_ResultGroup = pd.concat([DF_ResultGroup,
-                                        pd.DataFrame({'Group':NameGroup, 'OkNumberFile':OkNbFiles, 'NumberFile':str(NumberFiles) + '/' + str(Group['NumberFiles']), 'OkData': OkData}, index=[NameGroup]).astype(object)], 
+                                        pd.DataFrame(ResultGroup, index=[NameGroup]).astype(object)], 
                                         ignore_index=True)
+    finally:
+        if not Pool is None:
+            Pool.shutdown(cancel_futures=True)
+        if not Prefetcher is None:
+            Prefetcher.Close()
     
     logging.shutdown()
     
     if NumberFilesTotal == 0:
+        Report.Discard()
         filelist = glob(os.path.join(Settings['FolderHTMLReport'], '*'))
         for f in filelist:
             os.remove(f)
         os.rmdir(Settings['FolderHTMLReport'])
+        AppendFlagStore(DateCheck, None)
+        AppendChannelStore(DateCheck, None)
     elif not DF_ResultGroup.empty:
         #add summary table of groups
-        Style = DF_ResultGroup.loc[:,['Group','OkNumberFile','NumberFile','OkData']].style.format(na_rep='')
-        Style.applymap(ColorBool, subset=DF_ResultGroup.columns[DF_ResultGroup.dtypes==object])
+        Columns = [Column for Column in ['Group','OkNumberFile','NumberFile','OkData','OkDay','Completeness'] if Column in DF_ResultGroup.columns]
+        Style = DF_ResultGroup.loc[:,Columns].style.format(na_rep='')
+        Style.applymap(ColorBool, subset=Columns)
         Style.applymap(ColorNbFiles, subset='NumberFile')
         Style.set_table_styles([{'selector': '*', 'props': [('border','1px solid beige')]}])
         Style.hide(axis="index")
@@ -214,18 +656,381 @@ def QC(Site, DateCheck = None):
         Style.set_table_styles([{'selector': '*', 'props': [('border','1px solid beige')]}])
         Style.hide(axis="index")
         Summary += Style.to_html(render_links=True)
-        Report.FileContent = Report.FileContent.replace('***SUMMARY***', Summary)
+        Report.FillSlot('Summary', Summary)
+        
+        #add the durations of the stages, per group. The table is written in the report, so it cannot include the writing of the report (stage Report), found only in Timings.csv
+        DF_Timings = pd.DataFrame(Timings, columns=TimingColumns)
+        Rank = {NameGroup: Index for Index, NameGroup in enumerate(pd.unique(DF_Timings.Group))}
+        DF_Timings = DF_Timings.assign(File = DF_Timings.File.replace('', np.nan)).sort_values('Group', key=lambda Group: Group.map(Rank), kind='stable')
+        Style = DF_Timings.groupby(['Group', 'Stage'], sort=False).agg(Files=('File', 'nunique'), Wall=('Wall (s)', 'sum'), CPU=('CPU (s)', 'sum'), Rows=('Rows', 'sum')).style.format(precision=3)
+        Style.set_table_styles([{'selector': '*', 'props': [('border','1px solid beige')]}])
+        Report.Append('<details><summary>Timings (s), excluding the writing of this report (see Timings.csv)</summary>', False)
+        Report.Append(Style.to_html(), False)
+        Report.Append('</details>')
         
         #terminate the report
-        Report.Terminate()
+        with ClassTimer('Report'):
+            Report.Terminate()
+        pd.DataFrame(Timings, columns=TimingColumns).to_csv(os.path.join(Settings['FolderHTMLReport'], 'Timings.csv'), index=False, float_format='%.6f')
         
         #save short result to as csv file
         DF_Flags = pd.DataFrame(DF_ResultGroup.OkData & DF_ResultGroup.OkNumberFile).transpose()
         DF_Flags.index = [DateCheck]
         DF_Flags.columns = DF_ResultGroup.Group
         DF_Flags.to_csv(os.path.join(Settings['FolderHTMLReport'], 'Flags.csv'))
+        AppendFlagStore(DateCheck, DF_Flags)
+        
+        #save the statistics of the channels of the day
+        DF_Channels = pd.concat(DF_Channels, ignore_index=True)
+        DF_Channels.insert(0, 'Date', DateCheck)
+        DF_Channels = DF_Channels.loc[:, ChannelStoreColumns[:1] + ChannelStoreColumns[2:]]
+        DF_Channels.to_csv(os.path.join(Settings['FolderHTMLReport'], 'Channels.csv'), index=False)
+        AppendChannelStore(DateCheck, DF_Channels)
+        
+        #save the manifest for the next incremental QC of the day, and remove the pages of figures of the files not present anymore
+        if Settings['Incremental']:
+            WriteManifest(Settings['FolderHTMLReport'], ManifestNew)
+            for File, Entry in Manifest.items():
+                if not File in ManifestNew:
+                    RemoveFigurePages(Settings['FolderHTMLReport'], Entry['Result']['Group'], File)
+
+def ProcessFile(Group, Header, NameGroup, File, DateCheck, Content=None):
+    #perform all the tests on 1 data file
+    #Content: content of the file already read in memory by the prefetcher, None to read the file
+    #the tests write into a report fragment of their own, so that files can be processed in parallel. The fragment is stitched into the report of the day by QC
+    #return the test results, the html fragment, in a worker process the log records to replay in the log of the day, the durations of the stages, the data kept for the whole day analysis (None if not done)
+    #and the statistics of the channels to process (None if the file could not be loaded)
+    global Report
+    
+    ReportDay = globals().get('Report') #not defined in a worker process
+    Report = ClassReportFragment()
+    TimingStart = len(Timings)
+    if 'LogCollector' in globals():
+        LogCollector.Records = []
+    
+    try:
+        IsBM = 'BM' == Group['FILE_TYPE']
+        IsEC = 'EC' == Group['FILE_TYPE']
+        
+        BaseName = os.path.basename(File)
+        logger.info('Process ' + NameGroup + '\\' + BaseName)
+        #the name of the file links to its page of figures, if one is written (see the figure policy)
+        Link = BaseName
+        
+        Result = {'Group':NameGroup , 'Name':Link}
+        Result['OkImportation'] = True
+        DayData = None
+        ChannelStats = None
+        ZIP = None
+        if Group.FILE_COMPRESS == '.zip':
+            #the zip file is opened only once: TestZip checks the name of the member, then LoadFile decompresses it straight into the parser
+            with ClassTimer('TestZip'):
+                Result['OkImportation'], ZIP = TestZip(File, Group.FILE_EXTENSION, Content)
+        
+        Criteria = ReadCriteria(Group['FileHeader'])
+        Chunks = None
+        if Result['OkImportation'] and Settings['ChunkSize'] > 0:
+            #the file is loaded by chunks, only its timestamps are kept: the other data needed by the tests are accumulated chunk by chunk
+            with ClassTimer('LoadFileChunks') as Timer:
+                Chunks, Result['OkImportation'] = StreamFile(Group, File, Header, Criteria, Settings['ChunkSize'], PlotMaxPoints(Group), ZIP, Content)
+                if Result['OkImportation']:
+                    DF_data = Chunks['DF_time']
+                    Timer.Rows = len(DF_data)
+        elif Result['OkImportation']:
+            with ClassTimer('LoadFile') as Timer:
+                DF_data, Result['OkImportation'] = LoadFile(Group, File, Header, ZIP, Content)
+                if Result['OkImportation']:
+                    Timer.Rows = len(DF_data)
+        
+        if not ZIP is None:
+            ZIP.close()
+        
+        #keep the timestamps and the chosen channels for the analysis of the whole day
+        if Result['OkImportation'] and IsEC and Settings['WholeDayEC']:
+            if Chunks is None:
+                DayData = WholeDayData(DF_data)
+            else:
+                DayData = Chunks['DayData']
+        
+        #perform tests---------------------------------------------------------------
+        if Result['OkImportation']:
+            #test if corrupted file, missing columns, or some fields empty
+            Rows = len(DF_data)
+            if Chunks is None:
+                with ClassTimer('ColumnStats', Rows):
+                    Stats = ColumnStats(DF_data, Header, Criteria)
+                DF_columns = DF_data
+                Failures = {}
+                Traces = None
+            else:
+                Stats, DF_columns, Failures, Traces = Chunks['Stats'], Chunks['DF_columns'], Chunks['Failures'], Chunks['Traces']
+            ChannelStats = FileChannelStats(Stats, Rows)
+            Result['OkMissing'] = (Stats.NbEmpty == 0).all()
+            if Result['OkMissing']:
+                #test header
+                with ClassTimer('TestHeader'):
+                    Result['OkHeader'] = TestHeader(DF_columns, Group.FILE_HEAD_VARS, Header.index.tolist())
+                DF_data = DF_data.rename(columns=lambda x: x.strip('"'))
+                with ClassTimer('TestNbColumns', Rows):
+                    Result['OkNbColumns'] = TestNbColumns(DF_data, Stats)
+                #diagnostic values of the instruments listed in the diagnostic table: required ones are tested in every EC file, others if their channel is present
+                Diagnostics = ReadDiagnostics(Settings['FileDiagnostics']).drop_duplicates('Instrument')
+                for Index, Diagnostic in Diagnostics.iterrows():
+                    if (IsEC and Diagnostic.RequiredEC) or (Diagnostic.Channel in Stats.index):
+                        with ClassTimer('TestDiagnosticBits ' + Diagnostic.Instrument, Rows):
+                            Result[Diagnostic.Flag] = TestDiagnosticBits(DF_data, Diagnostic.Instrument, Failures=Failures.get(Diagnostic.Instrument))
+                if IsEC:
+                    DateFile = FileName2Date(BaseName)
+                elif IsBM:
+                    DateFile = datetime.combine(DateCheck, datetime.min.time()) + timedelta(days=1)
+                
+                #the timestamps are analysed once, the tests of the dates, times, number of records and gaps report on the result
+                with ClassTimer('TimestampIntegrity', Rows):
+                    Timestamps = TimestampIntegrity(DF_data, Group['Period'], DateFile)
+                if IsEC:
+                    Result['OkTimeEC'] = TestTimeEC(Timestamps)
+                Result['OkDates'] = TestDates(Timestamps, DateFile, 0.5)
+                Result['OkNbRecords'] = TestNbRecords(Timestamps, int(24*60*60 / Group['NumberFiles'] / Group['Period']))
+                Result['OkGaps'] = TestGaps(Timestamps, Group['Period'])
+                with ClassTimer('TestNum', Rows):
+                    Result['OkNum'] = TestNum(DF_data, Header, Stats)
+                if Result['OkNum']:
+                    with ClassTimer('TestNaN', Rows):
+                        Result['Oknan'] = TestNaN(DF_data, Header, Stats)
+                    with ClassTimer('TestRange', Rows):
+                        Result['OkRange'], NbOutRange = TestRange(DF_data, Header, Stats)
+                    #figures of the file, according to the figure policy of the group
+                    Policy = FigurePolicy(Group)
+                    if Policy == 'on_failure':
+                        Policy = 'always' if any(Value == False for Key, Value in Result.items() if Key.startswith('Ok')) else 'never'
+                    if Policy != 'never':
+                        with ClassTimer('OutputFigures', Rows):
+                            Link = '<a href="' + OutputFigures(DF_data, Header, NameGroup, BaseName, DateCheck, PlotMaxPoints(Group), Criteria['PlotGroups'], Traces) + '">' + BaseName + '</a>'
+                        Result['Name'] = Link
+        
+        Fragment = '<h3>' + Link + '</h3>' + Report.FileContent
+    finally:
+        Report = ReportDay
+        #the durations of the stages of the file are returned, QC records them with the group and the file name
+        FileTimings = Timings[TimingStart:]
+        del Timings[TimingStart:]
+    
+    if 'LogCollector' in globals():
+        LogRecords = LogCollector.Records
+    else:
+        LogRecords = []
+    
+    return Result, Fragment, LogRecords, FileTimings, DayData, ChannelStats
 
-def LoadFile(Group, File, Header):
+def FileChannelStats(Stats, NbRecords):
+    #statistics of the channels to process of a data file, saved in the channel store: number of records, of missing values and of values out of range, and minimum, maximum and sum of the valid values
+    Stats = Stats.loc[Stats.Process, :]
+    return pd.DataFrame({'NbRecords': NbRecords, 'NbNaN': Stats.NbNaN, 'NbOutRange': Stats.NbBelow + Stats.NbAbove, 'Min': Stats.Min, 'Max': Stats.Max, 'Sum': Stats.Sum}, index=Stats.index)
+
+def DayChannelStats(Header, Period, FileStats):
+    #statistics of the channels to process of a group over a day, from the statistics of its files (None for the files not loaded)
+    #the channels of the header without any file loaded get no record, so that a day without data shows in the channel store
+    Channels = Header.index[Header.Process.fillna(0).astype(bool)]
+    FileStats = [Stats for Stats in FileStats if not Stats is None]
+    if FileStats:
+        Stats = pd.concat(FileStats)
+        Stats = Stats.groupby(level=0, sort=False).agg(NbRecords=('NbRecords', 'sum'), NbNaN=('NbNaN', 'sum'), NbOutRange=('NbOutRange', 'sum'), Min=('Min', 'min'), Max=('Max', 'max'), Sum=('Sum', 'sum'))
+        Stats = Stats.reindex(Channels.union(Stats.index, sort=False))
+    else:
+        Stats = pd.DataFrame(index=Channels, columns=['NbRecords', 'NbNaN', 'NbOutRange', 'Min', 'Max', 'Sum'], dtype=float)
+    Stats[['NbRecords', 'NbNaN', 'NbOutRange']] = Stats[['NbRecords', 'NbNaN', 'NbOutRange']].fillna(0).astype(int)
+    NbValid = Stats.NbRecords - Stats.NbNaN
+    return pd.DataFrame({'Channel': Stats.index, 'NbExpected': int(round(24*60*60 / Period)), 'NbRecords': Stats.NbRecords, 'NbNaN': Stats.NbNaN, 'NbOutRange': Stats.NbOutRange,
+                         'Min': Stats.Min, 'Mean': (Stats.Sum / NbValid).where((NbValid > 0) & Stats.Max.notnull()), 'Max': Stats.Max}).reset_index(drop=True)
+
+def StreamFile(Group, File, Header, Criteria, ChunkSize, MaxPoints, ZIP=None, Content=None):
+    #load a data file by chunks of ChunkSize rows, and accumulate chunk by chunk what the tests need, so that the whole file is never in memory:
+    #   DF_time: the timestamps of the file, the only data kept for all the rows (8 bytes per row), used by the tests of the dates, records and gaps
+    #   DF_columns: an empty DataFrame with the columns of the file, for the test of the header
+    #   Stats: the statistics of the columns, as computed by ColumnStats on the whole file
+    #   Failures: per instrument of the diagnostic table whose channel is present, the failures of the diagnostic bits, as computed by BitFailures on the whole file
+    #   Traces: the decimated traces of the figures, None if the figures are not created
+    #   DayData: the data kept for the analysis of the whole day, None if not done
+    #return the accumulated data and if the file was loaded without error
+    Diagnostics = ReadDiagnostics(Settings['FileDiagnostics'])
+    IsDay = 'EC' == Group['FILE_TYPE'] and Settings['WholeDayEC']
+    Chunks = {'DF_columns': None, 'Stats': None, 'Failures': {}, 'Traces': None, 'DayData': None}
+    Times = []
+    DayData = []
+    NbRows = 0
+    
+    Ok = True
+    try:
+        for DF_chunk in LoadFileChunks(Group, File, Header, ChunkSize, ZIP, Content):
+            Stats = ColumnStats(DF_chunk, Header, Criteria)
+            if Chunks['Stats'] is None:
+                Chunks['DF_columns'] = DF_chunk.iloc[:0, :]
+                Chunks['Stats'] = Stats
+            else:
+                Chunks['Stats'] = CombineColumnStats(Chunks['Stats'], Stats)
+            
+            DF_chunk = DF_chunk.rename(columns=lambda x: x.strip('"'))
+            Times.append(DF_chunk.iloc[:, [0]])
+            
+            for Instrument, Table in Diagnostics.groupby('Instrument', sort=False):
+                Channel = Table.Channel.iat[0]
+                if Channel in DF_chunk.columns:
+                    Failures = BitFailures(DF_chunk.loc[:,Channel].to_numpy(dtype=float), Table.Bit.to_numpy(), Table.Nominal.to_numpy())
+                    Chunks['Failures'][Instrument] = CombineFailures(Chunks['Failures'].get(Instrument), Failures, NbRows)
+            
+            if IsDay:
+                DayData.append(WholeDayData(DF_chunk))
+            
+            #the figures are created only if all the channels to process are numeric
+            if FigurePolicy(Group) != 'never' and not (Chunks['Stats'].Process & ~Chunks['Stats'].Numeric).any():
+                Chunks['Traces'] = FigureTraces(DF_chunk, Criteria['PlotGroups'], MaxPoints, Chunks['Traces'])
+            
+            NbRows += len(DF_chunk)
+        
+        Chunks['DF_time'] = pd.concat(Times, ignore_index=True)
+        if IsDay:
+            Chunks['DayData'] = {Key: np.concatenate([Data[Key] for Data in DayData]) for Key in DayData[0]}
+    except Exception as e: # work on python 3.x
+        Ok = False
+        logger.info('Unexpected error: ' + str(e))
+    
+    return Chunks, Ok
+
+def CombineColumnStats(Stats, StatsChunk):
+    #statistics of the columns of a file loaded by chunks: the statistics of a new chunk are added to those of the previous chunks
+    #a column is numeric if it is numeric in all the chunks, its first non numeric value is that of the first chunk where there is one
+    Combined = Stats.copy()
+    for Column in ['NbEmpty', 'NbNaN', 'NbBelow', 'NbAbove']:
+        Combined[Column] += StatsChunk[Column].to_numpy()
+    Combined['Numeric'] &= StatsChunk['Numeric'].to_numpy()
+    Combined['FirstNonNumeric'] = np.where(Stats.FirstNonNumeric == '', StatsChunk.FirstNonNumeric, Stats.FirstNonNumeric)
+    Combined['Min'] = np.fmin(Stats.Min.to_numpy(), StatsChunk.Min.to_numpy())
+    Combined['Max'] = np.fmax(Stats.Max.to_numpy(), StatsChunk.Max.to_numpy())
+    Combined['Sum'] = np.where(np.isnan(Stats.Sum), StatsChunk.Sum, np.where(np.isnan(StatsChunk.Sum), Stats.Sum, Stats.Sum.to_numpy() + StatsChunk.Sum.to_numpy()))
+    #as on the whole file, the values out of range are not counted in the columns of text
+    Combined.loc[~Combined.Numeric, ['NbBelow', 'NbAbove']] = 0
+    Combined.loc[~Combined.Numeric, ['Min', 'Max', 'Sum']] = np.nan
+    return Combined
+
+def CombineFailures(Failures, FailuresChunk, Offset):
+    #failures of the diagnostic bits of a file loaded by chunks: the failures of a new chunk starting at row Offset are added to those of the previous chunks
+    First = np.where(FailuresChunk['First'] >= 0, FailuresChunk['First'] + Offset, -1)
+    Last = np.where(FailuresChunk['Last'] >= 0, FailuresChunk['Last'] + Offset, -1)
+    if Failures is None:
+        return {'NbFailures': FailuresChunk['NbFailures'], 'First': First, 'Last': Last}
+    return {'NbFailures': Failures['NbFailures'] + FailuresChunk['NbFailures'],
+            'First': np.where(Failures['First'] >= 0, Failures['First'], First),
+            'Last': np.where(Last >= 0, Last, Failures['Last'])}
+
+def ReadManifest(FolderReport):
+    #load the manifest of the files tested by the previous QC of the day: file identity, criteria version, results and report fragment per file
+    #the manifest is saved in the report folder of each day, so the manifests of a site are never written by 2 processes at once
+    FileManifest = os.path.join(FolderReport, 'Manifest.pkl')
+    Manifest = {}
+    if os.path.exists(FileManifest):
+        try:
+            with open(FileManifest, 'rb') as fid:
+                Manifest = pickle.load(fid)
+        except Exception as e:
+            logger.info('Manifest could not be read, all the files are tested: ' + str(e))
+    return Manifest
+
+def WriteManifest(FolderReport, Manifest):
+    #save the manifest of the day, replacing the previous one at once
+    FileManifest = os.path.join(FolderReport, 'Manifest.pkl')
+    with open(FileManifest + '_', 'wb') as fid:
+        pickle.dump(Manifest, fid)
+    os.replace(FileManifest + '_', FileManifest)
+
+def FileIdentity(File, Hash=False):
+    #identity of a data file, used to detect changes since the previous QC: size, modification time and optionally the md5 of the content
+    Stat = os.stat(File)
+    Identity = {'Size': Stat.st_size, 'MTime': Stat.st_mtime_ns, 'Hash': None}
+    if Hash:
+        md5 = hashlib.md5()
+        with open(File, 'rb') as fid:
+            for Block in iter(lambda: fid.read(BufferSize), b''):
+                md5.update(Block)
+        Identity['Hash'] = md5.hexdigest()
+    return Identity
+
+def IsUnchanged(Entry, Identity, Criteria):
+    #check if a file was already tested with the same criteria, and did not change since
+    #when hashes are available, they replace the modification time (the file may have been copied again without changes)
+    #entries saved by older versions, without the statistics of the channels, are not reused
+    if Entry is None or not 'ChannelStats' in Entry or Entry['Criteria'] != Criteria or Entry['Size'] != Identity['Size']:
+        return False
+    if Identity['Hash'] is None or Entry['Hash'] is None:
+        return Entry['MTime'] == Identity['MTime']
+    else:
+        return Entry['Hash'] == Identity['Hash']
+
+def RemoveFigurePages(FolderReport, NameGroup, File):
+    #remove the page of figures of a data file, if present
+    FilePage = os.path.join(FolderReport, NameGroup + '_' + os.path.basename(File) + '.html')
+    if os.path.exists(FilePage):
+        os.remove(FilePage)
+
+def CriteriaVersion(Group):
+    #version of the criteria used to test the files of a group: settings of the group and of the site, and modification times of the header and diagnostic files
+    #the settings of the figures are included, so that the pages of figures are written again when they change
+    Items = [str(Group.to_dict()), str(Settings['Figures']), str(Settings['PlotMaxPoints']), str(Settings['ChunkSize']), str(Settings['WholeDayEC']), str(Settings['WholeDayChannels'])]
+    for File in [Group['FileHeader'], Settings['FileDiagnostics']]:
+        Stat = os.stat(File)
+        Items.append(os.path.abspath(File) + ' ' + str(Stat.st_size) + ' ' + str(Stat.st_mtime_ns))
+    return hashlib.md5('\n'.join(Items).encode()).hexdigest()
+
+def LoadFile(Group, File, Header, ZIP=None, Content=None):
+    #load a data file into a DataFrame
+    #ZIP: the zip file already opened by TestZip, if the data file is compressed
+    #Content: content of the data file already read in memory, if not compressed
+    
+    #reuse the data parsed by a previous run, if cached
+    if Settings['CacheFolder']:
+        Key = CacheKey(Group, File, Header)
+        DF_data = ReadCache(Key)
+        if not DF_data is None:
+            logger.info('Data loaded from the cache')
+            return DF_data, True
+    
+    #try to load the data file---------------------------------------------------
+    Ok = True
+    try:
+        with OpenDataFile(File, ZIP, Content) as Stream:
+            Options, DateFormat = ReadOptions(Group, Header, Stream)
+            DF_data = pd.read_csv(Stream, **Options)
+        DF_data[DF_data.columns[0]] = pd.to_datetime(DF_data.iloc[:,0], format=DateFormat)
+    except Exception as e: # work on python 3.x
+        DF_data = None
+        Ok = False
+        logger.info('Unexpected error: ' + str(e))
+    
+    if Ok and Settings['CacheFolder']:
+        WriteCache(Key, DF_data)
+    return DF_data, Ok
+
+def LoadFileChunks(Group, File, Header, ChunkSize, ZIP=None, Content=None):
+    #load a data file by blocks of ChunkSize rows, so that the whole file is never in memory
+    #generator of DataFrames, with the same columns and types as LoadFile. The errors are raised to the caller
+    #a file without records gives 1 empty DataFrame, as LoadFile does
+    with OpenDataFile(File, ZIP, Content) as Stream:
+        Options, DateFormat = ReadOptions(Group, Header, Stream)
+        Head = Stream.peek(BufferSize)[:BufferSize]
+        NbChunks = 0
+        with pd.read_csv(Stream, chunksize=ChunkSize, **Options) as Reader:
+            for DF_chunk in Reader:
+                DF_chunk[DF_chunk.columns[0]] = pd.to_datetime(DF_chunk.iloc[:,0], format=DateFormat)
+                NbChunks += 1
+                yield DF_chunk
+        if NbChunks == 0:
+            #depending on the version of pandas, the reader gives no chunk for a file without records: the empty DataFrame is read from the header lines
+            DF_chunk = pd.read_csv(io.BytesIO(Head), **Options)
+            DF_chunk[DF_chunk.columns[0]] = pd.to_datetime(DF_chunk.iloc[:,0], format=DateFormat)
+            yield DF_chunk
+
+def ReadOptions(Group, Header, Stream):
+    #options of read_csv for a data file of a group, and format of its timestamps
+    #the format is detected from the first data row, read in the buffer of the stream without consuming it
     Columns = Header.index
     if int(Group.FILE_HEAD_NUM) == 0:
         skiprows = None
@@ -245,32 +1050,263 @@ def LoadFile(Group, File, Header):
     else:
         na = [Group.FILE_MISSING_VALUE]
     
-    #try to load the data file---------------------------------------------------
-    Ok = True
+    Lines = Stream.peek(BufferSize).decode('utf-8', errors='replace').splitlines()
+    if len(Lines) <= int(Group.FILE_HEAD_NUM):
+        #no data row: the file is loaded without records, any format fits
+        LenDate = 14
+    else:
+        LenDate = len(Lines[int(Group.FILE_HEAD_NUM)].split(',')[0].strip().strip('"'))
+    if LenDate == 12:
+        DateFormat = '%Y%m%d%H%M'
+    elif LenDate == 14:
+        DateFormat = '%Y%m%d%H%M%S'
+    elif LenDate > 14:
+        DateFormat = '%Y%m%d%H%M%S.%f'
+    else:
+        raise ValueError('Unexpected timestamp: ' + Lines[int(Group.FILE_HEAD_NUM)].split(',')[0])
+    
+    #add quotes if needed
+    if Group.FILE_TIMESTAMP == 'Quotes':
+        DateFormat = '"' + DateFormat + '"'
+    
+    #keep the timestamps as text, they are converted afterwards in 1 vectorized call
+    if Columns is None:
+        ColumnDate = Lines[int(Group.FILE_HEAD_VARS)-1].split(',')[0]
+    else:
+        ColumnDate = Columns[0]
+    
+    Options = {'skiprows': skiprows, 'header': RowHeader, 'dtype': {ColumnDate: str}, 'na_values': na, 'keep_default_na': False, 'quoting': 3, 'names': Columns}
+    return Options, DateFormat
+
+#Cache of parsed data files-------------------------------------------------------------------------------------------------------------------------
+#each successfully loaded DataFrame is saved in a folder of the cache, 1 .npy file per column, so that it can be loaded again without parsing the csv
+#the folders are named after a key of the file identity: a modified file gets a new key, its old folder is evicted in time
+
+def CacheKey(Group, File, Header):
+    #key of a data file in the cache: identity of the file and settings used to parse it
+    Stat = os.stat(File)
+    Items = [os.path.abspath(File), str(Stat.st_size), str(Stat.st_mtime_ns),
+             str(Group.FILE_HEAD_NUM), str(Group.FILE_HEAD_VARS), str(Group.FILE_MISSING_VALUE), str(Group.FILE_TIMESTAMP), ','.join(Header.index)]
+    return hashlib.md5('\n'.join(Items).encode()).hexdigest()
+
+def ReadCache(Key):
+    #load a DataFrame from the cache, None if not cached
+    FolderCache = os.path.join(Settings['CacheFolder'], Key)
     try:
-        #load 1 row to detect the date format
-        DF_spl = pd.read_csv(File, skiprows=skiprows, header=RowHeader, nrows=1, dtype=str)
-        LenDate = len(DF_spl.iat[0,0])
-        if LenDate == 12:
-            DateFormat = '%Y%m%d%H%M'
-        elif LenDate == 14:
-            DateFormat = '%Y%m%d%H%M%S'
-        elif LenDate > 14:
-            DateFormat = '%Y%m%d%H%M%S.%f'
-        
-        #add quotes if needed
-        if Group.FILE_TIMESTAMP == 'Quotes':
-            DateFormat = '"' + DateFormat + '"'
-        
-        # function to convert string into date
-        dateparse = lambda x: datetime.strptime(x, DateFormat)
-        
-        DF_data = pd.read_csv(File, skiprows=skiprows, header=RowHeader, parse_dates=[0], date_parser=dateparse, na_values = na, keep_default_na = False, quoting=3, names=Columns)
-    except Exception as e: # work on python 3.x
-        DF_data = None
-        Ok = False
-        logger.info("Unexpected error:", str(e))
-    return DF_data, Ok
+        with open(os.path.join(FolderCache, 'columns.json'), 'rt') as fid:
+            Columns = json.load(fid)
+        Data = {}
+        for i, (Column, DType) in enumerate(Columns):
+            Values = np.load(os.path.join(FolderCache, str(i) + '.npy'), mmap_mode='r')
+            Data[i] = Values.view(DType) if DType.startswith('datetime64') else Values
+        #the columns stay memory-mapped, read-only: the tests do not modify the data
+        DF_data = pd.DataFrame(Data, copy=False)
+        DF_data.columns = [Column for Column, DType in Columns]
+    except (OSError, ValueError):
+        return None
+    
+    #most recently used: the eviction removes the folders with the oldest modification time
+    os.utime(FolderCache)
+    return DF_data
+
+def WriteCache(Key, DF_data):
+    #save a DataFrame in the cache. Frames with non numeric columns are not cached, as they cannot be memory mapped
+    global CacheSize
+    
+    if not all(pd.api.types.is_numeric_dtype(DType) or pd.api.types.is_datetime64_dtype(DType) for DType in DF_data.dtypes):
+        return
+    
+    FolderCache = os.path.join(Settings['CacheFolder'], Key)
+    if os.path.exists(FolderCache):
+        return
+    #written in a temporary folder renamed at the end, so that other processes never read a partial entry
+    FolderTemp = FolderCache + '_' + str(os.getpid())
+    try:
+        os.makedirs(FolderTemp, exist_ok=True)
+        Columns = []
+        for i, Column in enumerate(DF_data.columns):
+            Values = DF_data.iloc[:, i].to_numpy()
+            Columns.append((Column, str(Values.dtype)))
+            if pd.api.types.is_datetime64_dtype(Values.dtype):
+                Values = Values.view(np.int64)
+            np.save(os.path.join(FolderTemp, str(i) + '.npy'), Values)
+        with open(os.path.join(FolderTemp, 'columns.json'), 'wt') as fid:
+            json.dump(Columns, fid)
+        os.rename(FolderTemp, FolderCache)
+    except OSError as e:
+        logger.info('Data could not be cached: ' + str(e))
+        shutil.rmtree(FolderTemp, ignore_errors=True)
+        return
+    
+    if 'CacheSize' not in globals():
+        CacheSize = FolderSize(Settings['CacheFolder'])
+    else:
+        CacheSize += FolderSize(FolderCache)
+    if CacheSize > Settings['CacheSizeMB'] * 1e6:
+        EvictCache()
+
+def EvictCache():
+    #remove the least recently used entries, until the cache is back to 80% of its maximum size
+    global CacheSize
+    
+    Entries = []
+    for Entry in os.scandir(Settings['CacheFolder']):
+        if Entry.is_dir():
+            Entries.append((Entry.stat().st_mtime, FolderSize(Entry.path), Entry.path))
+    Entries.sort()
+    
+    CacheSize = sum(Entry[1] for Entry in Entries)
+    for MTime, Size, Path in Entries:
+        if CacheSize <= 0.8 * Settings['CacheSizeMB'] * 1e6:
+            break
+        shutil.rmtree(Path, ignore_errors=True)
+        CacheSize -= Size
+    logger.info('Cache evicted, size: ' + str(round(CacheSize / 1e6)) + ' MB')
+
+def FolderSize(Folder):
+    #size in bytes of the files of a folder and its sub-folders
+    Size = 0
+    for Entry in os.scandir(Folder):
+        if Entry.is_dir():
+            Size += FolderSize(Entry.path)
+        else:
+            Size += Entry.stat().st_size
+    return Size
+
+#File discovery-------------------------------------------------------------------------------------------------------------------------------------
+#each data folder is listed once per process, and listed again only when modified (files added or removed). The names matching the file mask of a group are parsed once into sorted dates, where the files of a day are found by binary search
+
+def FindFiles(Group, DateCheck):
+    #return the data files of a group for a day, sorted by name
+    IsEC = 'EC' == Group['FILE_TYPE']
+    Folder = Group['Folder'].replace('<YYYY>', DateCheck.strftime('%Y')).replace('<MM>', DateCheck.strftime('%m')).replace('<DD>', DateCheck.strftime('%d'))
+    
+    if any(Character in Folder for Character in '*?['):
+        #folder with jokers: search with glob
+        PathMask = os.path.join(Folder, Group['FileMask'])
+        PathMask = PathMask.replace('<YYYY>', DateCheck.strftime('%Y')).replace('<MM>', DateCheck.strftime('%m')).replace('<DD>', DateCheck.strftime('%d'))
+        Files = sorted(glob(PathMask))
+        if IsEC:
+            #for EC files, we cannot use file names because the 30m-file ending at midnight is actually from the day before, so we use a filter based on datetime
+            DateStart = datetime.combine(DateCheck, datetime.min.time())
+            DateEnd = datetime.combine(DateCheck, datetime.min.time()) + timedelta(days=1)
+            Files = [File for File in Files if DateStart < FileName2Date(os.path.basename(File)) <= DateEnd]
+        return Files
+    
+    if not os.path.isdir(Folder):
+        return []
+    Index = ReadFolderIndex(Folder, Group['FileMask'], IsEC)
+    
+    #files with the date of the day in their name
+    KeyDay = ''.join([DateCheck.strftime(Token) for Token in Index['Tokens']])
+    Start = np.searchsorted(Index['Keys'], KeyDay, 'left')
+    End = np.searchsorted(Index['Keys'], KeyDay, 'right')
+    if IsEC:
+        #for EC files, we cannot use file names because the 30m-file ending at midnight is actually from the day before, so we use a filter based on datetime
+        Dates = Index['Dates'][Start:End]
+        DateStart = datetime.combine(DateCheck, datetime.min.time())
+        DateEnd = DateStart + timedelta(days=1)
+        Start, End = Start + np.searchsorted(Dates, np.datetime64(DateStart), 'right'), Start + np.searchsorted(Dates, np.datetime64(DateEnd), 'right')
+    return [os.path.join(Folder, Name) for Name in sorted(Index['Names'][Start:End])]
+
+def ReadFolderIndex(Folder, FileMask, IsEC):
+    #index of the files of a folder matching a file mask, reused as long as the folder is not modified
+    MTime = os.stat(Folder).st_mtime_ns
+    Key = (os.path.abspath(Folder), FileMask, IsEC)
+    Entry = FolderIndex.get(Key)
+    if Entry is None or Entry[0] != MTime:
+        Entry = (MTime, IndexFolder(Folder, FileMask, IsEC))
+        FolderIndex[Key] = Entry
+    return Entry[1]
+
+def IndexFolder(Folder, FileMask, IsEC):
+    #list the files of a folder matching a file mask, where <YYYY>, <MM>, <DD> match the date of the file, ? any character and * any text
+    #return a dictionary of arrays sorted by Keys then Dates:
+    #   Tokens: date formats of the tags in the mask, Keys: per file, its date written with the Tokens, Dates: for EC files, the date of the end of the file
+    Formats = {'<YYYY>': '%Y', '<MM>': '%m', '<DD>': '%d'}
+    Pattern = ''
+    Tokens = []
+    for Part in re.split('(<YYYY>|<MM>|<DD>)', FileMask):
+        if Part in Formats:
+            Pattern += '(\\d{' + str(len(Part) - 2) + '})'
+            Tokens.append(Formats[Part])
+        else:
+            Pattern += re.escape(Part).replace('\\?', '.').replace('\\*', '.*')
+    Regex = re.compile(Pattern, re.IGNORECASE if os.name == 'nt' else 0)
+    
+    Files = []
+    for Name in os.listdir(Folder):
+        Match = Regex.fullmatch(Name)
+        if not Match is None:
+            Files.append((''.join(Match.groups()), FileName2Date(Name) if IsEC else datetime.min, Name))
+    Files.sort()
+    
+    return {'Tokens': Tokens,
+            'Keys': np.array([File[0] for File in Files], dtype=str),
+            'Dates': np.array([File[1] for File in Files], dtype='datetime64[us]'),
+            'Names': np.array([File[2] for File in Files], dtype=object)}
+
+def OpenDataFile(File, ZIP=None, Content=None):
+    #open a data file as a buffered binary stream
+    #for zip files, the stream is the decompressed member, its CRC is checked when the parser reaches the end of the stream
+    #Content: content of the file already read in memory, read instead of the file
+    if not ZIP is None:
+        return io.BufferedReader(ZIP.open(ZIP.namelist()[0]), buffer_size=BufferSize)
+    elif not Content is None:
+        return io.BufferedReader(io.BytesIO(Content), buffer_size=BufferSize)
+    else:
+        return open(File, 'rb', buffering=BufferSize)
+
+#Prefetching of data files--------------------------------------------------------------------------------------------------------------------------
+#on network shares, reading a file takes a latency that adds to its tests. The next files are read by background threads while the current file is tested
+class ClassPrefetcher():
+    #read a list of files ahead, in the order they are tested
+    #Files: list of (file, size in bytes). Depth: maximum number of files read ahead. MaxBytes: maximum size of the files read ahead and not yet tested
+    #a file larger than MaxBytes is still read ahead, when no other file is
+    def __init__(self, Files, Depth, MaxBytes):
+        self.Files = Files
+        self.Depth = Depth
+        self.MaxBytes = MaxBytes
+        self.Pool = ThreadPoolExecutor(max_workers=Depth)
+        self.Futures = {} #per file read ahead: the future of its content, and its size
+        self.Next = 0 #index of the next file to read ahead
+        self.Bytes = 0 #size of the files read ahead
+        self.Fill()
+    
+    def Fill(self):
+        #read ahead the next files, within the limits of number and size
+        while self.Next < len(self.Files) and len(self.Futures) < self.Depth:
+            File, Size = self.Files[self.Next]
+            if self.Futures and self.Bytes + Size > self.MaxBytes:
+                break
+            self.Futures[File] = (self.Pool.submit(ReadBytes, File), Size)
+            self.Bytes += Size
+            self.Next += 1
+    
+    def Get(self, File):
+        #content of a file read ahead, waiting for the end of the reading if needed. None if the file was not read ahead or could not be read: the caller reads it, and reports the error
+        Entry = self.Futures.pop(File, None)
+        if Entry is None:
+            return None
+        Future, Size = Entry
+        self.Bytes -= Size
+        try:
+            Content = Future.result()
+        except Exception as e:
+            logger.info('File could not be read ahead: ' + str(e))
+            Content = None
+        self.Fill()
+        return Content
+    
+    def Close(self):
+        #stop reading ahead, the files not tested are discarded
+        self.Pool.shutdown(cancel_futures=True)
+        self.Futures = {}
+
+def ReadBytes(File):
+    #content of a file
+    with open(File, 'rb') as fid:
+        return fid.read()
 
 def ColorBool(val):
     #format colors of html table
@@ -288,6 +1324,10 @@ def ColorNbFiles(val):
         color = 'red'
     return 'color: %s' % color
 
+def IsActive(Group, DateCheck):
+    #check if a group should be processed for a day, based on its Process flag and Active dates
+    return Group['Process'] and (Group['ActiveFrom']<=DateCheck) and (pd.isnull(Group['ActiveTo']) or (DateCheck<=Group['ActiveTo']))
+
 def FileName2Date(BaseName):
     #return the date contained in the data file name
     Extension = os.path.splitext(BaseName)[1]
@@ -300,13 +1340,26 @@ def FileName2Date(BaseName):
 def GetInputArguments():
     #load input parameters, or use default---------------------------------
     parser = argparse.ArgumentParser(prog='checkETC', description='Check ETC files. Examples: "checkETC GL-ZaF -d now -y now" or "checkETC GL-ZaF -d 2022-01-01 -e 2022-01-31 -y 2022"')
-    parser.add_argument('Site', type=str, nargs='?', help='name of the site to check must match the section name in the ini file (for ex. "GL-ZaF").')
+    parser.add_argument('Site', type=str, nargs='?', help='name of the site to check must match the section name in the ini file (for ex. "GL-ZaF"). Several sites can be given as a comma-separated list.')
+    parser.add_argument('--all-sites', dest='AllSites', action='store_true', help='check all the sites of the ini file.')
     parser.add_argument('-d', dest='DateStart', metavar='DateStart', type=str, nargs='?', help='Date of the 1st day to check, format yyyy-mm-dd or "now". If not provided no data file is checked.')
     parser.add_argument('-e', dest='DateEnd', metavar='DateEnd', type=str, nargs='?', help='Date of the last day to check format yyyy-mm-dd or "now". If not provided only the data of DateStart is checked.')
     parser.add_argument('-y', dest='YearsReport', metavar='YearsReport', type=str, nargs='?', help='years used to produce yearly reports, comma-serparated-list of years or "now". If not provided, no yearly report is produced.')
+    parser.add_argument('-w', dest='Watch', metavar='Interval', type=int, nargs='?', const=60, help='watch mode: QC the files of the present day as they arrive, checking for new files every Interval seconds (60 by default), until interrupted. Only the new files are tested, and the report of the day is finalized after midnight. Several sites are watched one after another.')
+    parser.add_argument('--triage', dest='Triage', action='store_true', help='fast check of the days from DateStart to DateEnd instead of the QC: number of files, sizes, zip member names and last record of the files, without parsing them. The suspicious days are listed in the log and in a csv file, to QC fully.')
+    parser.add_argument('-j', dest='NbWorkers', metavar='NbWorkers', type=int, default=1, help='number of parallel worker processes: the days are spread over the workers when checking a range of dates, the data files when checking a single day. Default: 1.')
 
     args = parser.parse_args()
-    Site =  args.Site
+    if args.AllSites:
+        Sites = ListSites()
+    elif args.Site is None:
+        Sites = None
+    else:
+        Sites = [Site.strip() for Site in args.Site.split(',') if Site.strip()]
+    if Sites is None and (not args.DateStart is None or not args.YearsReport is None or not args.Watch is None or args.Triage):
+        parser.error('a site, or --all-sites, is required with -d, -y, -w and --triage')
+    if args.Triage and args.DateStart is None:
+        parser.error('--triage checks the days given by -d DateStart [DateEnd]')
     
     if args.DateStart is None:
         DateStart = None
@@ -329,14 +1382,16 @@ def GetInputArguments():
     else:
         YearsReport = [int(x) for x in args.YearsReport.split(',')]
     
-    return Site, DateStart, DateEnd, YearsReport
+    return Sites, DateStart, DateEnd, YearsReport, args.NbWorkers, args.Watch, args.Triage
 
-def Init(Site, DateCheck):
+def Init(Site, DateCheck, Incremental=None):
     global Settings
     
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
     
     ReadIni(Site)
+    if not Incremental is None:
+        Settings['Incremental'] = Incremental
     
     Settings['Year'] = DateCheck.strftime('%Y')
     Settings['Month'] = DateCheck.strftime('%m')
@@ -345,8 +1400,9 @@ def Init(Site, DateCheck):
     #report html folder
     Settings['FolderHTMLReport'] = Settings['FolderHTMLReport'].replace('<YYYY>', Settings['Year']).replace('<MM>', Settings['Month']).replace('<DD>', Settings['Day'])
     if not os.path.exists(Settings['FolderHTMLReport']):
-        os.makedirs(Settings['FolderHTMLReport'])
-    else:
+        #exist_ok: parallel workers may create the same parent folders at the same time
+        os.makedirs(Settings['FolderHTMLReport'], exist_ok=True)
+    elif not Settings['Incremental']:
         filelist = glob(os.path.join(Settings['FolderHTMLReport'], '*'))
         for f in filelist:
             try:
@@ -357,12 +1413,10 @@ def Init(Site, DateCheck):
     InitLogger(os.path.join(Settings['FolderHTMLReport'], 'QClog.txt'))
 
     #Import config file
-    Settings['Config'] = pd.read_csv(Settings['FileConfig'], skiprows=None, header=0, index_col=(0), parse_dates=['ActiveFrom','ActiveTo'], keep_default_na=False, quoting=3)
-    #convert datetime into date
-    Settings['Config']['ActiveTo'] = Settings['Config'].ActiveTo.dt.date
-    Settings['Config']['ActiveFrom'] = Settings['Config'].ActiveFrom.dt.date
+    Settings['Config'] = ReadCached(Settings['FileConfig'], LoadConfig)
 
-def InitLogger(FileLog):
+def InitLogger(FileLog, Mode='w'):
+    #log into the console and into FileLog, replacing the previous log file. Mode: 'w' to start a new log file, 'a' to add to it
     global logger
     # create formatter
     formatter = logging.Formatter('%(asctime)s> %(message)s')
@@ -389,7 +1443,7 @@ def InitLogger(FileLog):
         logger.addHandler(handler_console)
     
     # create file handler and set level to debug
-    handler_file = logging.FileHandler(FileLog, mode='w')
+    handler_file = logging.FileHandler(FileLog, mode=Mode)
     handler_file.setLevel(VerboseLevel)
     
     # add formatter to handler
@@ -398,25 +1452,158 @@ def InitLogger(FileLog):
     # add handler to logger
     logger.addHandler(handler_file)
 
+def InitWorker(SettingsQC):
+    #initialise a worker process testing data files of a QC day
+    #the log records are collected, and replayed by QC in the log file of the day
+    global Settings, logger, LogCollector
+    
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    Settings = SettingsQC
+    
+    logger = logging.getLogger()
+    logger.handlers.clear()
+    logger.setLevel(VerboseLevel)
+    LogCollector = ClassLogCollector()
+    LogCollector.setLevel(VerboseLevel)
+    logger.addHandler(LogCollector)
+
+class ClassLogCollector(logging.Handler):
+    #logging handler keeping the records in memory, to send them back to the main process
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.Records = []
+    
+    def emit(self, record):
+        #merge the arguments in the message, so that the record can be pickled
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.Records.append(record)
+
+def ListSites():
+    #sites of the ini file: 1 section per site
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    return ReadCached('checkETC.ini', LoadIni).sections()
+
 def ReadIni(Site):
     #load daat from the ini file into the variable Settings
     global Settings, INI
     
-    #load the ini file if not already laoded
-    if not 'INI' in globals():
-        INI = configparser.RawConfigParser()
-        INI.optionxform = str
-        INI.read('checkETC.ini')
+    #load the ini file if not already laoded, or modified since
+    INI = ReadCached('checkETC.ini', LoadIni)
     
     #create the Settings dictionary
     Settings = {'Site': Site}
     Settings['FileConfig'] = INI.get(Site, 'FileConfig')
     Settings['FolderHTMLReport'] = INI.get(Site, 'FolderHTMLReport')
+    Settings['FolderHome'] = Settings['FolderHTMLReport'].split('<')[0]
     #normally True, False only to save time because this is the slowest part
-    Settings['CreateFigures'] = INI.getboolean(Site, 'CreateFigures')
-    
+    Settings['CreateFigures'] = INI.getboolean(Site, 'CreateFigures', fallback=True)
+    #figure policy of the groups: always, on_failure (only for the files failing a test), or never. Can be set per group in the config file
+    Settings['Figures'] = INI.get(Site, 'Figures', fallback='always' if Settings['CreateFigures'] else 'never')
+    #table of the diagnostic bits tested per instrument
+    Settings['FileDiagnostics'] = INI.get(Site, 'FileDiagnostics', fallback='checkETC_diagnostics.csv')
+    #reuse the results of the files already tested by a previous QC of the same day, if the files and criteria did not change
+    Settings['Incremental'] = INI.getboolean(Site, 'Incremental', fallback=False)
+    #detect changes of the files with a hash of the content, rather than with the modification time
+    Settings['ManifestHash'] = INI.getboolean(Site, 'ManifestHash', fallback=False)
+    #folder of the cache of parsed data files, empty to disable the cache, and its maximum size
+    Settings['CacheFolder'] = INI.get(Site, 'CacheFolder', fallback='')
+    Settings['CacheSizeMB'] = INI.getfloat(Site, 'CacheSizeMB', fallback=1000)
+    #maximum number of points per trace of the figures, longer series are decimated. 0 to plot all the points
+    Settings['PlotMaxPoints'] = INI.getint(Site, 'PlotMaxPoints', fallback=5000)
+    #analysis of the EC files of a day as a whole, and the channels whose completeness is reported
+    Settings['WholeDayEC'] = INI.getboolean(Site, 'WholeDayEC', fallback=False)
+    Settings['WholeDayChannels'] = [Channel.strip() for Channel in INI.get(Site, 'WholeDayChannels', fallback='').split(',') if Channel.strip()]
+    #number of rows of the chunks of the data files loaded by chunks, to bound the memory used. 0 to load the files at once
+    Settings['ChunkSize'] = INI.getint(Site, 'ChunkSize', fallback=0)
+    #number of data files read ahead by background threads while a file is tested, 0 to not read ahead, and maximum size in MB of the files read ahead
+    Settings['PrefetchFiles'] = INI.getint(Site, 'PrefetchFiles', fallback=0)
+    Settings['PrefetchMB'] = INI.getfloat(Site, 'PrefetchMB', fallback=256)
+    #triage: accepted relative difference of the size of a file to the typical size of its group, and read of the last record of the files (for zip files, the member is decompressed)
+    Settings['TriageSizeTolerance'] = INI.getfloat(Site, 'TriageSizeTolerance', fallback=0.5)
+    Settings['TriageLastRecord'] = INI.getboolean(Site, 'TriageLastRecord', fallback=True)
+    #age in seconds after which the lock file of a store is considered left by a killed process, and removed
+    Settings['LockTimeout'] = INI.getfloat(Site, 'LockTimeout', fallback=600)
+
+#Settings files-------------------------------------------------------------------------------------------------------------------------------------
+#the ini, config, header and diagnostic files are loaded once per process, and loaded again only if modified: a QC of a range of dates does not read them again for each day and group
+
+def ReadCached(File, Load):
+    #return Load(File), reusing the result of a previous call as long as the file keeps the same size and modification time
+    Stat = os.stat(File)
+    Key = (os.path.abspath(File), Load.__name__)
+    Entry = FileCache.get(Key)
+    if Entry is None or Entry[0] != (Stat.st_size, Stat.st_mtime_ns):
+        Entry = ((Stat.st_size, Stat.st_mtime_ns), Load(File))
+        FileCache[Key] = Entry
+    return Entry[1]
+
+def LoadIni(File):
+    INI = configparser.RawConfigParser()
+    INI.optionxform = str
+    INI.read(File)
+    return INI
+
+def LoadConfig(File):
+    #config file: 1 row per data group
+    Config = pd.read_csv(File, skiprows=None, header=0, index_col=(0), parse_dates=['ActiveFrom','ActiveTo'], keep_default_na=False, quoting=3)
+    #convert datetime into date
+    Config['ActiveTo'] = Config.ActiveTo.dt.date
+    Config['ActiveFrom'] = Config.ActiveFrom.dt.date
+    return Config
+
+def ReadHeader(FileHeader):
+    #header file of a group: 1 row per channel, with its criteria
+    return ReadCached(FileHeader, LoadHeader)
+
+def LoadHeader(FileHeader):
+    return pd.read_csv(FileHeader, index_col=0)
+
+def ReadCriteria(FileHeader):
+    #criteria of a header file, compiled into the arrays used by the tests and the figures
+    return ReadCached(FileHeader, CompileCriteria)
+
+def CompileCriteria(FileHeader):
+    #Channels: channels of the header, Process: mask of the channels to process, Min, Max: thresholds of the channels
+    #PlotGroups: per figure, the channels plotted
+    Header = ReadHeader(FileHeader)
+    Criteria = {'Channels': Header.index,
+                'Process': Header.Process.fillna(0).to_numpy(dtype=bool),
+                'Min': Header.Min.to_numpy(dtype=float),
+                'Max': Header.Max.to_numpy(dtype=float)}
+    Channels = Header.loc[~Header.loc[:,'Group'].isnull(),:].index
+    Groups = Header.loc[Channels,'Group']
+    Criteria['PlotGroups'] = {Group: Channels[Groups==Group] for Group in pd.unique(Groups)}
+    return Criteria
+
 #Report functions-----------------------------------------------------------------------------------------------------------------------------------
-class ClassReport():
+class ClassReportFragment():
+    #piece of html report, filled by the tests of 1 data file and stitched afterwards into the report of the day
+    def __init__(self):
+        self.FileContent = ''
+    
+    def Append(self, Text, CR=True):
+        self.FileContent += Text
+        if CR:
+            self.FileContent += '\r\n'
+    
+    def AppendLink(self, Link, Text, CR):
+        self.Append('<a href="' + Link + '" target="_blank">' + Text + '</a>', CR)
+    
+    def AppendPopUpLink(self, PreText, Link, Text):
+        self.Append('<script language="javascript">' + '\n', False)
+        self.Append('var popupWindow = null;' + '\n', False)
+        self.Append('function positionedPopup(url,winName,w,h,t,l,scroll){' + '\n', False)
+        self.Append('settings =''height=''+h+'',width=''+w+'',top=''+t+'',left=''+l+'',scrollbars=''+scroll+'',resizable''' + '\n', False)
+        self.Append('popupWindow = window.open(url,winName,settings)}' + '\n', False)
+        self.Append('</script>' + '\n', False)
+        self.Append(PreText, False)
+        self.Append('<a href="' + Link + '" onclick="positionedPopup(this.href,''myWindow'',''800'',''450'',''100'',''100'',''yes'');return False">' + Text + '</a>', False)
+        
+class ClassReport(ClassReportFragment):
+    #html report streamed to a temporary file while it is built, renamed to its final name by Terminate
+    #slots reserve a place for a text known only at the end (e.g. the summary): the text appended after a slot goes to a new temporary part, and the parts are concatenated with the slot texts by Terminate
     def __init__(self, ParentFolder, RelativePath, Title, Comment=''):
         #Load model report file
         fid = open('ReportTemplate.html', 'rt')
@@ -433,35 +1620,48 @@ class ClassReport():
         #find the location of the body
         self.AppendPositionBody = self.Model.find(self.ReplaceStringBody)
         
-        #init report with the model
-        self.FileContent = self.Model[0:self.AppendPositionBody]
-        #replace title
-        self.FileContent = self.FileContent.replace(self.ReplaceStringTitle, Title)
+        #temporary files: the beginning of the report, then 1 part after each slot
+        self.Slots = {}
+        self.Parts = []
+        self.FileId = self.OpenPart(self.File + '_')
+        
+        #init report with the model, and replace title
+        self.Append(self.Model[0:self.AppendPositionBody].replace(self.ReplaceStringTitle, Title), False)
         if not Comment:
             self.Append(Comment, True)
         self.Append('Report generated automatically by python script running on computer "' + socket.gethostname() + '". IP: ' + ', '.join(socket.gethostbyname_ex(socket.gethostname())[2]))
         self.Append('Started ' + datetime.utcnow().strftime('%d.%m.%Y %H:%M:%S') + ' local time.')
 
+    def OpenPart(self, File):
+        FileId = open(File, 'wt')
+        if FileId == -1:
+            raise Exception(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + '> The file ' + File + ' could not be opened')
+        return FileId
+    
     def Append(self, Text, CR=True):
-        self.FileContent += Text
+        self.FileId.write(Text)
         if CR:
-            self.FileContent += '\r\n'
+            self.FileId.write('\r\n')
     
-    def AppendLink(self, Link, Text, CR):
-        self.Append('<a href="' + Link + '" target="_blank">' + Text + '</a>', CR)
+    def AddSlot(self, Name):
+        #reserve a place in the report for a text provided later with FillSlot
+        self.Slots[Name] = ''
+        self.FileId.close()
+        File = self.File + '_' + str(len(self.Parts))
+        self.Parts.append((Name, File))
+        self.FileId = self.OpenPart(File)
+    
+    def FillSlot(self, Name, Text):
+        self.Slots[Name] = Text
+    
+    def Discard(self):
+        #close and remove the temporary files, without producing the report
+        self.FileId.close()
+        for File in [self.File + '_'] + [File for Name, File in self.Parts]:
+            os.remove(File)
     
-    def AppendPopUpLink(self, PreText, Link, Text):
-        self.Append('<script language="javascript">' + '\n', False)
-        self.Append('var popupWindow = null;' + '\n', False)
-        self.Append('function positionedPopup(url,winName,w,h,t,l,scroll){' + '\n', False)
-        self.Append('settings =''height=''+h+'',width=''+w+'',top=''+t+'',left=''+l+'',scrollbars=''+scroll+'',resizable''' + '\n', False)
-        self.Append('popupWindow = window.open(url,winName,settings)}' + '\n', False)
-        self.Append('</script>' + '\n', False)
-        self.Append(PreText, False)
-        self.Append('<a href="' + Link + '" onclick="positionedPopup(this.href,''myWindow'',''800'',''450'',''100'',''100'',''yes'');return False">' + Text + '</a>', False)
-        
     def Terminate(self):
-        #write the text in the report file and close it
+        #write the end of the report, stitch the parts and the slots, and rename the report file
         
         logger.info('TerminateReport')
         
@@ -469,20 +1669,41 @@ class ClassReport():
         
         #write the last part of the html file
         self.Append(self.Model[self.AppendPositionBody + len(self.ReplaceStringBody):], False)
+        self.FileId.close()
         
-        FileId = open(self.File + '_', 'wt')
-        if FileId == -1:
-            raise Exception(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + '> The file ' + self.File + ' could not be opened')
-        
-        FileId.write(self.FileContent)
-        
-        #close the html report file
-        FileId.close()
+        if self.Parts:
+            with open(self.File + '_', 'at') as FileId:
+                for Name, File in self.Parts:
+                    FileId.write(self.Slots[Name])
+                    FileId.flush()
+                    with open(File, 'rb') as FilePart:
+                        shutil.copyfileobj(FilePart, FileId.buffer)
+                    os.remove(File)
         
         if os.path.exists(self.File):
             os.remove(self.File)
         os.rename(self.File + '_', self.File)
     
+#Timings-------------------------------------------------------------------------------------------------------------------------------------------
+TimingColumns = ['Group', 'File', 'Stage', 'Wall (s)', 'CPU (s)', 'Rows']
+
+class ClassTimer():
+    #measure the wall time and the CPU time of a stage of the QC, recorded in Timings at the end of the stage
+    #Rows: number of rows processed by the stage, can be set during the stage
+    def __init__(self, Stage, Rows=0, Group='', File=''):
+        self.Stage = Stage
+        self.Rows = Rows
+        self.Group = Group
+        self.File = File
+    
+    def __enter__(self):
+        self.WallStart = time.perf_counter()
+        self.CPUStart = time.process_time()
+        return self
+    
+    def __exit__(self, *Exception):
+        Timings.append({'Group': self.Group, 'File': self.File, 'Stage': self.Stage, 'Wall (s)': time.perf_counter() - self.WallStart, 'CPU (s)': time.process_time() - self.CPUStart, 'Rows': self.Rows})
+
 #QC tests-------------------------------------------------------------------------------------------------------------------------------------------
 def TestHeader(DF, FILE_HEAD_VARS, ColumnsExpected):
     global Settings
@@ -515,15 +1736,18 @@ def TestHeader(DF, FILE_HEAD_VARS, ColumnsExpected):
             
     return OkHeader
 
-def TestNbColumns(DF):
+def TestNbColumns(DF, Stats=None):
     global Settings
     
     logger.info('TestNbColumns')
     
+    if Stats is None:
+        Stats = ColumnStats(DF)
+    
     Report.Append('Check number of columns: ', False)
     
-    NbChannelsMissing = (DF == '').all().sum()
-    NbChannelsExpected = DF.shape[1]
+    NbChannelsMissing = (Stats.NbEmpty == len(DF)).sum()
+    NbChannelsExpected = len(Stats)
     NbChannelsImported = NbChannelsExpected - NbChannelsMissing
     
     if NbChannelsMissing > 0:
@@ -537,8 +1761,38 @@ def TestNbColumns(DF):
     
     return OkNbColumns
 
-def TestDates(DF, DateFile, GapAcceptance):
+def TimestampIntegrity(DF, Period, DateFile=None, MaxIntervals=10):
+    #analysis of the timestamps of a file (first column), viewed once as int64 nanoseconds, on which TestDates, TestTimeEC, TestNbRecords and TestGaps report
+    #Period in seconds; DateFile: date inferred from the file name, indicating the timestamp of the last record
+    #the steps between consecutive records differing from Period by TimeTolerance (1 ms) or more are gaps, described as intervals (start, end, duration) for the first MaxIntervals of them.
+    #Steps of 0 are duplicates, negative steps are backwards jumps. Timestamps that are not multiples of 100 ms are misaligned
+    Timestamps = {'NbRecords': len(DF), 'NbGaps': 0, 'NbDuplicates': 0, 'NbBackwards': 0, 'NbMisaligned': 0}
+    if len(DF) == 0:
+        return Timestamps
+    
+    Times = DF.iloc[:,0].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    Timestamps['First'], Timestamps['Last'] = Times[0], Times[-1]
+    if not DateFile is None:
+        Timestamps['LastOffset'] = (pd.Timestamp(DateFile).value - Times[-1]) / 1e9
+    
+    Steps = np.diff(Times)
+    IsGap = np.abs(Steps - int(round(Period * 1e9))) >= TimeTolerance
+    Gaps = np.flatnonzero(IsGap)
+    Timestamps['NbGaps'] = len(Gaps)
+    Timestamps['NbDuplicates'] = np.count_nonzero(Steps == 0)
+    Timestamps['NbBackwards'] = np.count_nonzero(Steps < 0)
+    Gaps = Gaps[:MaxIntervals]
+    Timestamps['Gaps'] = np.column_stack((Times[Gaps], Times[Gaps + 1], Steps[Gaps]))
+    
+    Misaligned = np.flatnonzero(Times % 100000000)
+    Timestamps['NbMisaligned'] = len(Misaligned)
+    if len(Misaligned) > 0:
+        Timestamps['FirstMisaligned'], Timestamps['LastMisaligned'] = Times[Misaligned[0]], Times[Misaligned[-1]]
+    return Timestamps
+
+def TestDates(Timestamps, DateFile, GapAcceptance):
     #check dates
+    #Timestamps: result of TimestampIntegrity
     #DateFile: date inferred from the file name, indicating the timestamp of the last record
     #GapAcceptance in seconds
     global Settings
@@ -547,12 +1801,12 @@ def TestDates(DF, DateFile, GapAcceptance):
     
     Report.Append('Check dates: ', False)
     
-    if len(DF) == 0:
+    if Timestamps['NbRecords'] == 0:
         Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
         Ok = False
     else:
-        Report.Append('last record: ' + DF.iat[-1,0].strftime('%d/%m/%Y %H:%M:%S') + ' -> ', False)
-        LastGapHour = (DateFile - DF.iat[-1,0].to_pydatetime()).total_seconds()
+        Report.Append('last record: ' + pd.Timestamp(Timestamps['Last']).strftime('%d/%m/%Y %H:%M:%S') + ' -> ', False)
+        LastGapHour = Timestamps['LastOffset']
         if abs(LastGapHour) > GapAcceptance:
             Ok = False
             Report.Append('<span style="color: rgb(255,0,0);">', False)
@@ -564,41 +1818,47 @@ def TestDates(DF, DateFile, GapAcceptance):
     
     return Ok
 
-def TestTimeEC(DF):
+def TestTimeEC(Timestamps):
     #check milliseconds of timestamps are multiple of 100ms
+    #Timestamps: result of TimestampIntegrity
     global Settings
     
-    logger.info('TestDates')
+    logger.info('TestTimeEC')
     
     Report.Append('Check times: ', False)
     
-    if len(DF) == 0:
+    if Timestamps['NbRecords'] == 0:
         Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
         OkTIMESTAMP = False
     else:
-        KoTIMESTAMPs = (DF.TIMESTAMP.astype(np.int64)%100000000) > 0
-        OkTIMESTAMP = all(~KoTIMESTAMPs)
+        OkTIMESTAMP = Timestamps['NbMisaligned'] == 0
         if OkTIMESTAMP:
             Report.Append('<span style="color: rgb(0,255,0);">Ok</span>')
         else:
-            FirstWrongTIMESTAMP = DF.TIMESTAMP[KoTIMESTAMPs.index[KoTIMESTAMPs][0]]
-            LastWrongTIMESTAMP = DF.TIMESTAMP[KoTIMESTAMPs.index[KoTIMESTAMPs][-1]]
+            FirstWrongTIMESTAMP = pd.Timestamp(Timestamps['FirstMisaligned'])
+            LastWrongTIMESTAMP = pd.Timestamp(Timestamps['LastMisaligned'])
             Report.Append('<span style="color: rgb(255,0,0);">', False)
             Report.Append('Unexpected time stamp from ' + FirstWrongTIMESTAMP.strftime('%d/%m/%Y %H:%M:%S.%f') + ' to ' + LastWrongTIMESTAMP.strftime('%d/%m/%Y %H:%M:%S.%f'))
             Report.Append('</span>', False)
     
     return OkTIMESTAMP
 
-def TestZip(FileZip, FILE_EXTENSION):
+def TestZip(FileZip, FILE_EXTENSION, Content=None):
     #test that the name in the zip file is correct
-    logger.info('TestNbRecords')
+    #Content: content of the zip file already read in memory, None to open the file
+    #return the result of the test and the opened zip file (None if it cannot be opened), to be read by LoadFile and closed by the caller
+    logger.info('TestZip')
     Report.Append('Check file name in the zip file: ', False)
     
     Ok = False
-    #unzip
-    ZIP = ZipFile(FileZip, 'r')
+    try:
+        ZIP = ZipFile(FileZip if Content is None else io.BytesIO(Content), 'r')
+    except Exception as e:
+        ZIP = None
+        Report.Append('<span style="color: rgb(255,0,0);">Corrupted zip file: ' + str(e) + '</span>')
+        return Ok, ZIP
+    
     CompressedFiles = ZIP.namelist()
-    ZIP.close()
     if len(CompressedFiles) == 1:
         Ok = os.path.splitext(os.path.basename(FileZip))[0] + FILE_EXTENSION == CompressedFiles[0]
     
@@ -607,16 +1867,17 @@ def TestZip(FileZip, FILE_EXTENSION):
     else:
         Report.Append('<span style="color: rgb(255,0,0);">Files in the zip: ' + ','.join(CompressedFiles) + '</span>')
     
-    return Ok
+    return Ok, ZIP
 
-def TestNbRecords(DF, NbExpectedRecords):
+def TestNbRecords(Timestamps, NbExpectedRecords):
     #check the number of records
+    #Timestamps: result of TimestampIntegrity
     global Settings
     
     logger.info('TestNbRecords')
     
     Report.Append('Check number of records: ', False)
-    NbRecords = len(DF)
+    NbRecords = Timestamps['NbRecords']
     
     Report.Append(str(NbRecords) + ' -> ', False)
     
@@ -625,7 +1886,7 @@ def TestNbRecords(DF, NbExpectedRecords):
         Report.Append('<span style="color: rgb(255,0,0);">', False)
         Report.Append(str(100.0*NbRecords/NbExpectedRecords) + ' % of expected records')
         if NbRecords > 0:
-            Report.Append('From ' + DF.iat[0,0].strftime('%d/%m/%Y %H:%M:%S') + ' to ' + DF.iat[-1,0].strftime('%d/%m/%Y %H:%M:%S'))
+            Report.Append('From ' + pd.Timestamp(Timestamps['First']).strftime('%d/%m/%Y %H:%M:%S') + ' to ' + pd.Timestamp(Timestamps['Last']).strftime('%d/%m/%Y %H:%M:%S'))
         
         Report.Append('</span>', False)
     else:
@@ -634,31 +1895,31 @@ def TestNbRecords(DF, NbExpectedRecords):
     
     return Ok
 
-def TestGaps(DF, Period):
+def TestGaps(Timestamps, Period):
+    #Timestamps: result of TimestampIntegrity
     global Settings
     
     logger.info('TestGaps')
     
     #look for gaps in the date
     Report.Append('Gap detection in the date: ', False)
-    if len(DF) == 0:
+    if Timestamps['NbRecords'] == 0:
         Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
+        Ok = False
     else:
-        Period_ms = int(Period * 1000)
-        
-        RawDateTest = DF.iloc[:,0].diff().astype('timedelta64[ms]') != Period_ms
-        NbGap = RawDateTest[1:].values.sum()
+        NbGap = Timestamps['NbGaps']
         
         if NbGap != 0:
             Ok = False
-            MaxDisplayed = 10
             Report.Append('<span style="color: rgb(255,0,0);">', False)
             Report.Append(str(NbGap) + ' gap(s) detected for the periods:')
+            if Timestamps['NbDuplicates'] > 0 or Timestamps['NbBackwards'] > 0:
+                Report.Append('   including ' + str(Timestamps['NbDuplicates']) + ' duplicated timestamp(s) and ' + str(Timestamps['NbBackwards']) + ' backward jump(s)')
             
-            for i, DateGap in enumerate(DF.iloc[RawDateTest[0:MaxDisplayed].index,0]):
-                Report.Append('   ' + DateGap.strftime('%d/%m/%Y %H:%M:%S.%f') + ' > ' + DF.iat[i+1,0].strftime('%d/%m/%Y %H:%M:%S.%f'))                
+            for Start, End, Duration in Timestamps['Gaps']:
+                Report.Append('   ' + pd.Timestamp(Start).strftime('%d/%m/%Y %H:%M:%S.%f') + ' > ' + pd.Timestamp(End).strftime('%d/%m/%Y %H:%M:%S.%f') + ' (%0.3f s)' % (Duration / 1e9))
 
-            if MaxDisplayed < NbGap:
+            if len(Timestamps['Gaps']) < NbGap:
                 Report.Append('   ...', False)
             
             Report.Append('</span>', True)
@@ -668,24 +1929,100 @@ def TestGaps(DF, Period):
     
     return Ok
 
-def TestNaN(DF, Header):
+def WholeDayData(DF):
+    #data of a file kept for the analysis of the whole day: the timestamps in ns, and the chosen channels in single precision
+    DayData = {'TIMESTAMP': DF.iloc[:,0].to_numpy(dtype='datetime64[ns]').view(np.int64)}
+    Columns = {Column.strip('"'): Column for Column in DF.columns}
+    for Channel in Settings['WholeDayChannels']:
+        if Channel in Columns:
+            DayData[Channel] = pd.to_numeric(DF[Columns[Channel]], errors='coerce').to_numpy(dtype=np.float32)
+    return DayData
+
+def TestWholeDay(DayData, Period, DateCheck):
+    #join the timestamps of the EC files of a day into 1 array, in the order of the files, and check the day as a whole: gaps, overlaps (time going backward), duplicated records, including at the boundaries between files, and completeness
+    #DayData: per file, its name and the data kept by WholeDayData (None if the file could not be loaded)
+    #return the result of the test and the completeness of the day: fraction of the expected records present
+    global Settings
+    
+    logger.info('TestWholeDay')
+    
+    Report.Append('Check the whole day: ', False)
+    
+    #the files without records (e.g. header only) are left out, so that each boundary between records is between 2 files with records
+    DayData = [(Name, Data) for Name, Data in DayData if not Data is None and len(Data['TIMESTAMP']) > 0]
+    Lengths = np.array([len(Data['TIMESTAMP']) for Name, Data in DayData], dtype=int)
+    if len(DayData) == 0:
+        Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
+        return False, 0.0
+    
+    Times = np.concatenate([Data['TIMESTAMP'] for Name, Data in DayData])
+    Period_ns = int(round(Period * 1e9))
+    DayStart = np.datetime64(datetime.combine(DateCheck, datetime.min.time()), 'ns').view(np.int64)
+    NbExpected = int(round(24*60*60 / Period))
+    
+    #steps between consecutive records, and the steps between the last record of a file and the first of the next one
+    Steps = np.diff(Times)
+    Ends = np.cumsum(Lengths) - 1
+    IsBoundary = np.zeros(len(Steps), dtype=bool)
+    IsBoundary[Ends[Ends < len(Steps)]] = True
+    IsGap = Steps - Period_ns >= TimeTolerance
+    IsOverlap = Steps < 0
+    
+    #slots of the expected time grid of the day filled by a record, each counted once: a record fills its nearest slot if it is less than TimeTolerance from it (timestamp jitter)
+    Slots = (Times - DayStart + Period_ns // 2) // Period_ns
+    OnGrid = np.abs(Times - DayStart - Slots * Period_ns) < TimeTolerance
+    #records of the same slot, or with the same timestamp off the grid, are duplicates
+    Keys = np.where(OnGrid, DayStart + Slots * Period_ns, Times)
+    NbDuplicates = len(Keys) - len(np.unique(Keys))
+    NbFilled = len(np.unique(Slots[OnGrid & (1 <= Slots) & (Slots <= NbExpected)]))
+    Completeness = NbFilled / NbExpected
+    
+    Ok = Completeness == 1 and NbDuplicates == 0 and not (IsGap.any() or IsOverlap.any())
+    Report.Append('completeness ' + '%0.2f' % (100.0*Completeness) + ' % -> ', False)
+    if Ok:
+        Report.Append('<span style="color: rgb(0,255,0);">Ok</span>')
+    else:
+        Report.Append('<span style="color: rgb(255,0,0);">', False)
+        Report.Append(str(NbFilled) + '/' + str(NbExpected) + ' records, from ' + pd.Timestamp(Times[0]).strftime('%d/%m/%Y %H:%M:%S.%f') + ' to ' + pd.Timestamp(Times[-1]).strftime('%d/%m/%Y %H:%M:%S.%f'))
+        if NbDuplicates > 0:
+            Report.Append(str(NbDuplicates) + ' duplicated record(s)')
+        for Text, IsKo in [('gap(s)', IsGap), ('overlap(s)', IsOverlap)]:
+            if IsKo.any():
+                Report.Append(str(IsKo.sum()) + ' ' + Text + ', ' + str((IsKo & IsBoundary).sum()) + ' between files:')
+                MaxDisplayed = 10
+                for Index in np.flatnonzero(IsKo)[:MaxDisplayed]:
+                    Report.Append('   ' + pd.Timestamp(Times[Index]).strftime('%d/%m/%Y %H:%M:%S.%f') + ' > ' + pd.Timestamp(Times[Index+1]).strftime('%d/%m/%Y %H:%M:%S.%f'), False)
+                    if IsBoundary[Index]:
+                        File = np.searchsorted(Ends, Index)
+                        Report.Append(' (' + DayData[File][0] + ' > ' + DayData[File+1][0] + ')', False)
+                    Report.Append('', True)
+                if MaxDisplayed < IsKo.sum():
+                    Report.Append('   ...')
+        Report.Append('</span>', False)
+    
+    #completeness of the chosen channels: valid values over the expected records
+    for Channel in Settings['WholeDayChannels']:
+        NbValid = sum([np.count_nonzero(~np.isnan(Data[Channel])) for Name, Data in DayData if Channel in Data])
+        Report.Append(Channel + ': ' + '%0.2f' % (100.0*NbValid/NbExpected) + ' % of the expected records are valid')
+    
+    return Ok, Completeness
+
+def TestNaN(DF, Header, Stats=None):
     global Settings
     
     logger.info('TestNaN')
     
+    if Stats is None:
+        Stats = ColumnStats(DF, Header)
+    
     #Check for NaN
     Report.Append('Look for NaN: ', False)
     
     Ok = True
     Result = {}
-    for Channel, Data in DF.iteritems():
-        if Header.at[Channel, 'Process']:
-            #compute the nb of nan
-            IsNaN = Data.isnull()
-            NbNaN = IsNaN.sum()
-            if NbNaN > 0:
-                Result[Channel] = NbNaN
-                Ok = False
+    for Channel, NbNaN in Stats.NbNaN[Stats.Process & (Stats.NbNaN > 0)].items():
+        Result[Channel] = NbNaN
+        Ok = False
         
     if Ok:
         Report.Append('<span style="color: rgb(0,255,0);">Ok</span>')
@@ -700,11 +2037,14 @@ def TestNaN(DF, Header):
     
     return Ok
 
-def TestNum(DF, Header):
+def TestNum(DF, Header, Stats=None):
     global Settings
     
     logger.info('TestNum')
     
+    if Stats is None:
+        Stats = ColumnStats(DF, Header)
+    
     #Check for out of range values
     Report.Append('Look for non numeric channels: ', False)
     Ok = True
@@ -713,18 +2053,13 @@ def TestNum(DF, Header):
         Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
         Ok = False
     else:
-        for Channel, Data in DF.iteritems():
-            logging.debug(Channel)
-            if Header.at[Channel, 'Process']:
-                #test min value
-                if not pd.api.types.is_numeric_dtype(Data):
-                    if Ok:
-                        #if first channel with out of range value
-                        Report.Append('<span style="color: rgb(255,0,0);">', False)
-                        Report.Append('Non numeric channels:', True)
-                        Ok = False
-                    FirstNonNumericValue = (Data[pd.to_numeric(Data, errors='coerce').isnull()]).iat[0]
-                    Report.Append('   ' + Channel + ': ' + FirstNonNumericValue, True)
+        for Channel, ChannelStats in Stats.loc[Stats.Process & ~Stats.Numeric, :].iterrows():
+            if Ok:
+                #if first non numeric channel
+                Report.Append('<span style="color: rgb(255,0,0);">', False)
+                Report.Append('Non numeric channels:', True)
+                Ok = False
+            Report.Append('   ' + Channel + ': ' + ChannelStats.FirstNonNumeric, True)
     
     if Ok == True:
         Report.Append('<span style="color: rgb(0,255,0);">Ok</span>')
@@ -733,11 +2068,14 @@ def TestNum(DF, Header):
     
     return Ok
 
-def TestRange(DF, Header):
+def TestRange(DF, Header, Stats=None):
     global Settings
     
     logger.info('TestRange')
     
+    if Stats is None:
+        Stats = ColumnStats(DF, Header)
+    
     #Check for out of range values
     Report.Append('Look for out of range values: ', False)
     Ok = True
@@ -746,40 +2084,20 @@ def TestRange(DF, Header):
     if len(DF) == 0:
         Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
         Ok = False
-        for Channel in DF.columns:
+        for Channel in Stats.index:
             NbOutRange[Channel] = 0
     else:
-        for Channel, Data in DF.iteritems():
-            logging.debug(Channel)
-            if Header.at[Channel, 'Process']:
-                #test min value
-                if np.isnan(Header.at[Channel, 'Min']):
-                    #if the treshold if nan, considers value is in range
-                    OutMin = np.zeros(len(Data), dtype=bool) #[False] * len(DF.Channel[Channel]['Data'])
-                else:
-                    OutMin = Data < Header.at[Channel, 'Min']
-                
-                #test max value
-                if np.isnan(Header.at[Channel, 'Max']):
-                    #if the treshold if nan, considers value is in range
-                    OutMax = np.zeros(len(Data), dtype=bool)
-                else:
-                    OutMax = Header.at[Channel, 'Max'] < Data
-                OutRange = OutMin | OutMax 
-                
-                NbOutRange[Channel] = OutRange.sum()
-                if NbOutRange[Channel] > 0:
-                    if Ok == True:
-                        #if first channel with out of range value
-                        Report.Append('<span style="color: rgb(255,0,0);">', False)
-                        Report.Append('detected for the following channels:', True)
-                    
-                    Report.Append('   ' + Channel + ': ' + str(NbOutRange[Channel]) + ' (' + str(NbOutRange[Channel]*100.0/len(DF)) + '%)', True)
+        #if a treshold is nan, values are considered in range
+        NbOutRange = (Stats.NbBelow + Stats.NbAbove).to_dict()
+        for Channel in Stats.index[(Stats.NbBelow + Stats.NbAbove) > 0]:
+            if Ok == True:
+                #if first channel with out of range value
+                Report.Append('<span style="color: rgb(255,0,0);">', False)
+                Report.Append('detected for the following channels:', True)
+            
+            Report.Append('   ' + Channel + ': ' + str(NbOutRange[Channel]) + ' (' + str(NbOutRange[Channel]*100.0/len(DF)) + '%)', True)
 
-                    Ok = False
-                
-            else:
-                NbOutRange[Channel] = 0
+            Ok = False
     
     if Ok == True:
         Report.Append('<span style="color: rgb(0,255,0);">Ok</span>')
@@ -788,42 +2106,105 @@ def TestRange(DF, Header):
     
     return Ok, NbOutRange
     
+def ColumnStats(DF, Header=None, Criteria=None):
+    #statistics of the columns of a data file, used by the tests TestNbColumns, TestNum, TestNaN, TestRange and for the missing fields
+    #the numeric channels to process (Process=1 in the header) are tested in 1 pass over their 2-D block of values, against the Min and Max arrays of the header
+    #Criteria: criteria of the header compiled by CompileCriteria, used as they are if the channels of the file are those of the header
+    #return a DataFrame indexed by channel (quotes removed), with the columns:
+    #   Process: channel to process, Numeric: numeric column, NbEmpty: nb of empty fields
+    #   NbNaN: nb of missing values, NbBelow, NbAbove: nb of values below Min and above Max, FirstNonNumeric: first non numeric value of a channel to process
+    #   Min, Max, Sum: minimum, maximum and sum of the valid values of a numeric channel to process, NaN if none
+    Channels = pd.Index([Channel.strip('"') for Channel in DF.columns])
+    if not Criteria is None and Channels.equals(Criteria['Channels']):
+        Process, Min, Max = Criteria['Process'], Criteria['Min'], Criteria['Max']
+    elif Header is None:
+        Process = np.zeros(len(Channels), dtype=bool)
+        Min = Max = np.full(len(Channels), np.nan)
+    else:
+        Criteria = Header.reindex(Channels)
+        Process = Criteria.Process.fillna(0).to_numpy(dtype=bool)
+        Min = Criteria.Min.to_numpy(dtype=float)
+        Max = Criteria.Max.to_numpy(dtype=float)
+    Numeric = np.array([pd.api.types.is_numeric_dtype(DType) for DType in DF.dtypes], dtype=bool)
+    NbEmpty = np.zeros(len(Channels), dtype=int)
+    NbNaN = np.zeros(len(Channels), dtype=int)
+    NbBelow = np.zeros(len(Channels), dtype=int)
+    NbAbove = np.zeros(len(Channels), dtype=int)
+    FirstNonNumeric = np.full(len(Channels), '', dtype=object)
+    ValueMin = np.full(len(Channels), np.nan)
+    ValueMax = np.full(len(Channels), np.nan)
+    ValueSum = np.full(len(Channels), np.nan)
+    
+    #empty fields can only be in text columns
+    IsText = (DF.dtypes == object).to_numpy()
+    if IsText.any():
+        NbEmpty[IsText] = (DF.iloc[:, IsText].to_numpy() == '').sum(axis=0)
+    
+    #numeric channels to process
+    IsBlock = Process & Numeric
+    if IsBlock.any():
+        Block = DF.iloc[:, IsBlock].to_numpy(dtype=float)
+        NbNaN[IsBlock] = np.isnan(Block).sum(axis=0)
+        with np.errstate(invalid='ignore'):
+            NbBelow[IsBlock] = (Block < Min[IsBlock]).sum(axis=0)
+            NbAbove[IsBlock] = (Block > Max[IsBlock]).sum(axis=0)
+        if len(Block) > 0:
+            ValueMin[IsBlock] = np.fmin.reduce(Block, axis=0)
+            ValueMax[IsBlock] = np.fmax.reduce(Block, axis=0)
+            ValueSum[IsBlock] = np.where(NbNaN[IsBlock] < len(Block), np.nansum(Block, axis=0), np.nan)
+    
+    #text channels to process
+    for Index in np.flatnonzero(Process & ~Numeric):
+        Data = DF.iloc[:, Index]
+        NbNaN[Index] = Data.isnull().sum()
+        if len(Data) > 0:
+            FirstNonNumeric[Index] = (Data[pd.to_numeric(Data, errors='coerce').isnull()]).iat[0]
+    
+    return pd.DataFrame({'Process': Process, 'Numeric': Numeric, 'NbEmpty': NbEmpty, 'NbNaN': NbNaN, 'NbBelow': NbBelow, 'NbAbove': NbAbove, 'FirstNonNumeric': FirstNonNumeric, 'Min': ValueMin, 'Max': ValueMax, 'Sum': ValueSum}, index=Channels)
+    
 def TestDiagnosticByte(DF, DiagnosticChannel):
     #DiagnosticChannel = 'Diagnostic Value' #GHG
     #DiagnosticChannel = 'GA_DIAG_CODE' #ETC
-    logger.info('TestDiagnosticByte')
-    
     #Check the licor diagnostic byte (specific to licor 7200 or 7500)
     #Bits (starting at 1) from 5 to 13 should all be 1 (=True in python)
-    BitName = ['AGC0', 'AGC1', 'AGC2', 'AGC3', 'Sync Flag', 'PLL', 'Detector Temperature', 'Chopper Temperature', 'Head Pressure', 'Aux Inputs', 'Inlet T', 'Outlet T', 'Head']
+    return TestDiagnosticBits(DF, 'LI-7200', DiagnosticChannel)
+    
+def TestDiagnosticBits(DF, Instrument, DiagnosticChannel=None, Failures=None):
+    #Check the bits of the diagnostic value of an instrument, as described in the diagnostic table (FileDiagnostics in the ini file)
+    #DiagnosticChannel: name of the diagnostic channel, if different from the one in the table
+    #Failures: failures of the bits already computed by BitFailures, for a file loaded by chunks. If not provided, computed from DF
+    logger.info('TestDiagnosticBits ' + Instrument)
+    
+    Table = ReadDiagnostics(Settings['FileDiagnostics'])
+    Table = Table.loc[Table.Instrument == Instrument, :]
+    if DiagnosticChannel is None:
+        DiagnosticChannel = Table.Channel.iat[0]
     
-    Report.Append('Check the diagnostic byte: ', False)
+    Report.Append(Table.Title.iat[0], False)
     Ok = True
     
     if len(DF) == 0:
         Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
         Ok = False
     else:
-        if not(DiagnosticChannel in DF.columns):
-            Report.Append('<span style="color: rgb(255,0,0);">No Diagnostic Value</span>')
+        if Failures is None and not(DiagnosticChannel in DF.columns):
+            Report.Append('<span style="color: rgb(255,0,0);">No ' + DiagnosticChannel + '</span>')
             Ok = False
         else:
-            DefaultByte = 0b1111111110000
-            ListWithoutNan = DF.loc[:,DiagnosticChannel].copy(deep=True)
-            ListWithoutNan.loc[np.isnan(ListWithoutNan)] = DefaultByte
-            for NoBit in range(4, 13):
-                Bit = bitget_n(ListWithoutNan, NoBit)
-            
-                if not all(Bit):
-                    PositionFirst = Bit.index(False)
-                    PositionLast = len(Bit) - 1 - Bit[::-1].index(False)
-                    
+            if Failures is None:
+                Failures = BitFailures(DF.loc[:,DiagnosticChannel].to_numpy(dtype=float), Table.Bit.to_numpy(), Table.Nominal.to_numpy())
+            for i, NbFailures in enumerate(Failures['NbFailures']):
+                if NbFailures > 0:
                     if Ok: #if there was no error so far
                         Report.Append(' ', True)
                         Report.Append('<span style="color: rgb(255,0,0);">', False)
-
-                    Report.AppendPopUpLink('Diagnostic error: ', '../diagnostic_description/description.html', BitName[NoBit])
-                    Report.Append('. First error at: ' + DF.TIMESTAMP[PositionFirst].strftime('%d/%m/%Y %H:%M:%S') + '. Last error at: ' + DF.TIMESTAMP[PositionLast].strftime('%d/%m/%Y %H:%M:%S'), True)
+                    
+                    if pd.isnull(Table.Description.iat[i]):
+                        Report.Append('Diagnostic error: ' + Table.Name.iat[i], False)
+                    else:
+                        Report.AppendPopUpLink('Diagnostic error: ', Table.Description.iat[i], Table.Name.iat[i])
+                    Report.Append(' (' + str(NbFailures * 100.0 / len(DF)) + '%). ', False)
+                    Report.Append('First error at: ' + DF.iat[Failures['First'][i], 0].strftime('%d/%m/%Y %H:%M:%S') + '. Last error at: ' + DF.iat[Failures['Last'][i], 0].strftime('%d/%m/%Y %H:%M:%S'), True)
                     
                     Ok = False
     
@@ -833,198 +2214,239 @@ def TestDiagnosticByte(DF, DiagnosticChannel):
         Report.Append('</span>', False)
     
     return Ok
-    
-def TestDiagnosticByte2(DF, DiagnosticChannel):
-    #DiagnosticChannel = 'Diagnostic Value 2'
-    logger.info('TestDiagnosticByte2')
-    
-    #Check the licor diagnostic byte 2 (specific to licor 7700)
-    #should be 1
-    
-    Report.Append('Check the diagnostic byte 2: ', False)
-    Ok = True
-    
-    if len(DF) == 0:
-        Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
-        Ok = False
-    else:
-        if not(DiagnosticChannel in DF.columns):
-            Report.Append('<span style="color: rgb(255,0,0);">No Diagnostic Value 2</span>')
-            Ok = False
-        else:
-            Bit = DF.loc[:,DiagnosticChannel].astype(bool).tolist() #converts nan to 1, so it is fine
-            if  not all(Bit):
-                PositionFirst = Bit.index(False)
-                PositionLast = len(Bit) - 1 - Bit[::-1].index(False)
-                if Ok: #if there was no error so far
-                    Report.Append(' ', True)
-                    Report.Append('<span style="color: rgb(255,0,0);">', False)
-                PercentageBad = (len(Bit) - sum(Bit)) * 100.0 / len(Bit)
-                Report.Append('Diagnostic value 2 (li7700 not synchronised) error (' + str(PercentageBad) + '%). ', False)
-                Report.Append('First error at: ' + DF.TIMESTAMP[PositionFirst].strftime('%d/%m/%Y %H:%M:%S') + '. Last error at: ' + DF.TIMESTAMP[PositionLast].strftime('%d/%m/%Y %H:%M:%S'), True)
 
-                Ok = False
-    
-    
-    if Ok == True:
-        Report.Append('<span style="color: rgb(0,255,0);">Ok</span>')
-    else:
-        Report.Append('</span>', False)
-    
-    return Ok
+def BitFailures(Values, Bits, Nominal):
+    #test bits of diagnostic values against their nominal values, in 1 vectorized pass over the values
+    #Values: float array of diagnostic values, NaN are not tested
+    #Bits: array of the bit positions to test, starting from 0
+    #Nominal: array of the nominal value (0 or 1) of each bit
+    #return a dictionary of arrays, 1 element per bit: number of failures, position of the first and last failure (-1 if no failure)
+    if len(Values) == 0:
+        return {'NbFailures': np.zeros(len(Bits), dtype=int), 'First': np.full(len(Bits), -1), 'Last': np.full(len(Bits), -1)}
+    Valid = ~np.isnan(Values)
+    Codes = np.where(Valid, Values, 0).astype(np.int64)
+    Failed = ((Codes[:, np.newaxis] >> np.asarray(Bits, dtype=np.int64)) & 1) != np.asarray(Nominal, dtype=np.int64)
+    Failed &= Valid[:, np.newaxis]
+    
+    NbFailures = Failed.sum(axis=0)
+    First = np.where(NbFailures > 0, Failed.argmax(axis=0), -1)
+    Last = np.where(NbFailures > 0, len(Values) - 1 - Failed[::-1].argmax(axis=0), -1)
+    
+    return {'NbFailures': NbFailures, 'First': First, 'Last': Last}
 
-def TestDiagnosticByteCH4(DF):
-    logger.info('TestDiagnosticByteCH4')
-    
-    #Check the licor CH4 diagnostic byte (specific to licor 7700)
-    #Bits (starting at 1) 1 should be 1
-    #Bits 2.3.4 should be 1
-    #Bits 5-16 should be 0
-    
-    BitName = ['BOXCONNECTED', 'BADAUXTC3', 'BADAUXTC2', 'BADAUXTC1', 'MOTORFAILURE', 'CALIBRATING', 'BOTTOMHEATERON', 'TOPHEATERON', 'PUMPON', 'MOTORSPINNING', 'BLOCKTEMPUNREGULATED', 'LASERTEMPUNREGULATED', 'BADTEMP', 'REFUNLOCKED', 'NOSIGNAL', 'NOTREADY']
-    nan = float('nan')
-    BitNominalValue = [True, nan, nan, nan, False, nan, nan, nan, nan, nan, False, False, False, False, False, False] # if nan, the bit is not tested (True=1)
-    
-    Report.Append('Check the CH4 diagnostic byte: ', False)
-    Ok = True
-    
-    if len(DF) == 0:
-        Report.Append('<span style="color: rgb(255,0,0);">No data</span>')
-        Ok = False
-    else:
-        DiagnosticChannel = 'CH4 Diagnostic Value'
-        if not (DiagnosticChannel in DF.Channel.keys()):
-            Report.Append('<span style="color: rgb(255,0,0);">No Diagnostic Value</span>')
-            Ok = False
-        else:
-            DefaultByte = 0b1
-            ListWithoutNan = copy.deepcopy(DF.Channel[DiagnosticChannel]['Data'])
-            ListWithoutNan[np.isnan(ListWithoutNan)] = DefaultByte
-            ListWithoutNan = ListWithoutNan.astype(int).tolist()
-            for NoBit in range(0, 16):
-                if not np.isnan(BitNominalValue[NoBit]):
-                    Bit = bitget_n(ListWithoutNan, NoBit)
-                    Bit = [x == BitNominalValue[NoBit] for x in Bit]
-            
-            #Bit = [True]*len(DF.Channel[DiagnosticChannel]['Data'])
-            #for NoBit in range(0, 16):
-            #    if not isnan(BitNominalValue[NoBit]):
-            #        for i, x in enumerate(DF.Channel[DiagnosticChannel]['Data']):
-            #            if isnan(x):
-            #                Bit[i] = True
-            #            else:
-            #                Bit[i] = bitget(uint16(x), NoBit) == BitNominalValue[NoBit]
-
-                    if not all(Bit):
-                        PositionFirst = Bit.index(False)
-                        PositionLast = len(Bit) - 1 - Bit[::-1].index(False)
-                        if Ok: #if there was no error so far
-                            Report.Append(' ', True)
-                            Report.Append('<span style="color: rgb(255,0,0);">', False)
-                        
-                        Report.AppendPopUpLink('Diagnostic error: ', '../diagnostic_description/descriptionCH4.html', BitName[NoBit])
-                        PercentageBad = (len(Bit) - sum(Bit)) * 100.0 / len(Bit)
-                        Report.Append(' (' + str(PercentageBad) + '%). ', False)
-                        Report.Append('First error at: ' + DF.TIMESTAMP[PositionFirst].strftime('%d/%m/%Y %H:%M:%S') + '. Last error at: ' + DF.TIMESTAMP[PositionLast].strftime('%d/%m/%Y %H:%M:%S'), True)
-
-                        Ok = False
-    
-    
-    if Ok == True:
-        Report.Append('<span style="color: rgb(0,255,0);">Ok</span>')
-    else:
-        Report.Append('</span>', False)
-    
-    return Ok
+def ReadDiagnostics(FileDiagnostics):
+    #load the table of the diagnostic bits of the instruments: 1 row per tested bit
+    return ReadCached(FileDiagnostics, pd.read_csv)
 
-def bitget_n(byteList, NoBit):
-    #bit index strart from 0
-    mask = 1<<NoBit
-    return [(x&mask)!=0 for x in byteList]
 #---------------------------------------------------------------------------------------------------------------------------------------------------
 
-def OutputFigures(DF, Header, NameGroup, BaseName, DateCheck):
+def OutputFigures(DF, Header, NameGroup, BaseName, DateCheck, MaxPoints=0, PlotGroups=None, Traces=None):
     #produce an html file containing figures
+    #MaxPoints: maximum number of points per trace, series longer are decimated. 0 to plot all the points
+    #PlotGroups: per figure, the channels plotted, as compiled by CompileCriteria. If not provided, taken from the column Group of the header
+    #Traces: points of the traces already computed by FigureTraces, for a file loaded by chunks. If not provided, computed from DF
     global Settings
     
-    Link = ''
-    if Settings['CreateFigures']: #normaly True, False only for testing, because this is the slowest part
-        logger.info('Create png figures')
-        #HTML report object
-        ReportFigure = ClassReport(Settings['FolderHTMLReport'], NameGroup + '_' + BaseName + '.html', Settings['Site'] + ' ' + DateCheck.strftime('%Y-%m-%d') + ' ' + NameGroup , 'File ' + BaseName + '. ')
-        
-        #to not load JS for each figure, but only for the first
-        FirstPlot = 'cdn'
-        
+    logger.info('Create png figures')
+    #HTML report object
+    ReportFigure = ClassReport(Settings['FolderHTMLReport'], NameGroup + '_' + BaseName + '.html', Settings['Site'] + ' ' + DateCheck.strftime('%Y-%m-%d') + ' ' + NameGroup , 'File ' + BaseName + '. ')
+    
+    if PlotGroups is None:
         Channels = Header.loc[~Header.loc[:,'Group'].isnull(),:].index
         Groups = Header.loc[Channels,'Group']
-        
-        for Group in pd.unique(Groups):
-            #init the figure
-            fig = go.Figure()
-            PlotMin = True
-            PlotMax = True
-            for Channel in Channels[Groups==Group]:
-                Data = DF.loc[:,Channel]
-                logger.info('Generate figure for channel: ' + Channel)
-                
-                IsNaN = Data.isnull()
-                NbNaN = IsNaN.sum()
-                NbOk = len(Data) - NbNaN
-                
-                IsOk = ~ IsNaN
-                DateOk = DF.loc[IsOk,'TIMESTAMP']
-                DataOk = Data.loc[IsOk]
-                
-                #plot min & max thresholds if some values are out of range
-                [Min, Max] = Header.loc[Channel, ['Min', 'Max']]
-                if (not np.isnan(Min)) and PlotMin and any(DataOk<Min):
-                    fig.add_trace(go.Scatter(x=DateOk.iloc[[0, -1]], y=[Min,Min], mode='lines', name = 'Min', line=dict(dash='dash')))
-                    PlotMin = False
-                if (not np.isnan(Max)) and PlotMax and any(DataOk>Max):
-                    fig.add_trace(go.Scatter(x=DateOk.iloc[[0, -1]], y=[Max,Max], mode='lines', name = 'Max', line=dict(dash='dash')))
-                    PlotMax = False
-                
-                #plot data
-                if len(DataOk) > 0:
-                    fig.add_trace(go.Scatter(x=DateOk, y=DataOk, mode='lines', name = Channel))
+        PlotGroups = {Group: Channels[Groups==Group] for Group in pd.unique(Groups)}
+    
+    if Traces is None:
+        Traces = FigureTraces(DF, PlotGroups, MaxPoints)
+    
+    #the points are plotted by plotly.js in the browser, from the data of the figures saved in the page
+    ReportFigure.Append('<div id="Figures"></div>')
+    ReportFigure.Append('<script charset="utf-8" src="' + PlotlyAsset() + '"></script>')
+    ReportFigure.Append('<script type="text/javascript">var FigureData = ' + json.dumps(FigureData(FigureSpecs(Header, PlotGroups, Traces))) + ';</script>')
+    ReportFigure.Append('''<script type="text/javascript">
+function DecodeArray(Text, Type) {
+    const Bytes = Uint8Array.from(atob(Text), Char => Char.charCodeAt(0));
+    return new Type(Bytes.buffer);
+}
+const Axes = FigureData.axes.map(Axis => Float64Array.from(DecodeArray(Axis.offsets, Axis.type == 'f8' ? Float64Array : Int32Array), Offset => Axis.base + Offset));
+for (const Figure of FigureData.figures) {
+    const Div = document.createElement('div');
+    document.getElementById('Figures').appendChild(Div);
+    const Traces = Figure.traces.map(Trace => Object.assign({}, Trace, {x: Axes[Trace.x], y: DecodeArray(Trace.y, Float32Array)}));
+    Plotly.newPlot(Div, Traces, {title: {text: Figure.title}, xaxis: {type: 'date'}, template: FigureData.template}, {responsive: true});
+}
+</script>''')
+    
+    ReportFigure.Terminate()
+    return ReportFigure.Link
+
+def FigureData(Figures):
+    #data of the figures as read by the pages of figures: the arrays are encoded in base64, the values in single precision
+    #the timestamps are saved in a list of time axes referenced by the traces, so that the traces of channels without NaN nor decimation share the same axis
+    #each axis is its first timestamp in ms since 1970, and the 32 bits offsets of the timestamps from it in ms (javascript does not read 64 bits integers as numbers)
+    #the offsets of an axis spanning more than 32 bits of ms (about 24.8 days) are saved as 64 bits floats
+    Axes = []
+    AxisIndex = {}
+    Data = {'template': pio.templates.default.to_plotly_json(), 'axes': Axes, 'figures': []}
+    for Figure in Figures:
+        Traces = []
+        for Trace in Figure['traces']:
+            Times = np.asarray(Trace['x']).astype('datetime64[ms]').view(np.int64)
+            Base = int(Times[0]) if len(Times) > 0 else 0
+            Offsets = Times - Base
+            Int32 = np.iinfo('<i4')
+            if len(Offsets) == 0 or (Int32.min <= Offsets.min() and Offsets.max() <= Int32.max):
+                X = (Base, 'i4', EncodeArray(Offsets.astype('<i4')))
+            else:
+                X = (Base, 'f8', EncodeArray(Offsets.astype('<f8')))
+            if not X in AxisIndex:
+                AxisIndex[X] = len(Axes)
+                Axes.append({'base': X[0], 'type': X[1], 'offsets': X[2]})
+            Traces.append(dict(Trace, x=AxisIndex[X], y=EncodeArray(np.asarray(Trace['y'], dtype='<f4'))))
+        Data['figures'].append({'title': Figure['title'], 'traces': Traces})
+    return Data
+
+def EncodeArray(Values):
+    #array encoded in base64, read in javascript as a typed array of the same type
+    return base64.b64encode(np.ascontiguousarray(Values).tobytes()).decode('ascii')
+
+def PlotlyAsset(Folder=None):
+    #path of plotly.js relative to Folder, by default the folder of the report of the day. 1 copy of plotly.js is shared by all the pages of figures, saved in the report home folder at the first use
+    #the report folders may not have access to internet
+    File = os.path.join(Settings['FolderHome'], 'plotly-' + get_plotlyjs_version() + '.min.js')
+    if not os.path.exists(File):
+        os.makedirs(Settings['FolderHome'], exist_ok=True)
+        with open(File + '_' + str(os.getpid()), 'wt', encoding='utf-8') as fid:
+            fid.write(get_plotlyjs())
+        os.replace(File + '_' + str(os.getpid()), File)
+    return os.path.relpath(File, Settings['FolderHTMLReport'] if Folder is None else Folder).replace(os.sep, '/')
+
+def FigureSpecs(Header, PlotGroups, Traces):
+    #traces of the figures, 1 figure per group of channels: list of figures with their title and their traces, as plotly scatter traces
+    Figures = []
+    for Group, Channels in PlotGroups.items():
+        Scatters = []
+        PlotMin = True
+        PlotMax = True
+        for Channel in Channels:
+            Trace = Traces[Channel]
+            logger.info('Generate figure for channel: ' + Channel)
+            
+            DateOk = Trace['DateOk']
+            DataOk = Trace['DataOk']
+            
+            #plot min & max thresholds if some values are out of range. The decimation keeps the extreme values
+            [Min, Max] = Header.loc[Channel, ['Min', 'Max']]
+            if (not np.isnan(Min)) and PlotMin and any(DataOk<Min):
+                Scatters.append(dict(x=DateOk[[0, -1]], y=[Min,Min], mode='lines', name = 'Min', line=dict(dash='dash')))
+                PlotMin = False
+            if (not np.isnan(Max)) and PlotMax and any(DataOk>Max):
+                Scatters.append(dict(x=DateOk[[0, -1]], y=[Max,Max], mode='lines', name = 'Max', line=dict(dash='dash')))
+                PlotMax = False
+            
+            #plot data
+            if Trace['NbOk'] > 0:
+                Scatters.append(dict(x=DateOk, y=DataOk, mode='lines', name = Channel))
+            
+            #plot NaN
+            if Trace['NbNaN'] > 0:
+                if Trace['NbOk'] == 0:
+                    MeanSingleValue = 0
+                else:
+                    #compute average values
+                    MeanSingleValue = Trace['Sum'] / Trace['NbOk']
                 
-                #plot NaN
-                if NbNaN > 0:
-                    if NbOk == 0:
-                        MeanSingleValue = 0
-                    else:
-                        #compute average values
-                        MeanSingleValue = np.mean(DataOk)
-                    
-                    DataNaN = [MeanSingleValue]*NbNaN
-                    DateNaN = DF.loc[IsNaN,'TIMESTAMP']
-                    fig.add_trace(go.Scatter(x=DateNaN, y=DataNaN, mode='markers', name = Channel + 'NaN'))
-                    
-            fig.update_layout(title=Group)
-            FigHtml = fig.to_html(full_html=False, include_plotlyjs=FirstPlot, default_height='40%')
-            ReportFigure.Append(FigHtml)
-            FirstPlot = False
-            Link = ReportFigure.Link
+                DataNaN = np.full(len(Trace['DateNaN']), MeanSingleValue)
+                Scatters.append(dict(x=Trace['DateNaN'], y=DataNaN, mode='markers', name = Channel + 'NaN'))
         
-        ReportFigure.Terminate()
-    return Link
+        Figures.append({'title': Group, 'traces': Scatters})
+    return Figures
+
+def FigurePolicy(Group):
+    #figure policy of a group: column Figures of the config file if filled for the group, otherwise value of the ini file
+    if 'Figures' in Group.index and str(Group['Figures']).strip() != '':
+        Policy = str(Group['Figures']).strip()
+    else:
+        Policy = Settings['Figures']
+    if not Policy in ['always', 'on_failure', 'never']:
+        raise ValueError('Unexpected figure policy: ' + Policy)
+    return Policy
+
+def FigureTraces(DF, PlotGroups, MaxPoints, Traces=None):
+    #points of the traces of the figures, per channel: the valid values and their timestamps, the timestamps of the NaN, decimated to MaxPoints, and the number and sum of the valid values
+    #Traces: traces of the previous chunks of a file loaded by chunks. The points of DF are appended to them and decimated again, so that the traces never exceed MaxPoints
+    if Traces is None:
+        Traces = {}
+    Dates = DF.loc[:,'TIMESTAMP'].to_numpy()
+    for Channels in PlotGroups.values():
+        for Channel in Channels:
+            Data = DF.loc[:,Channel].to_numpy()
+            IsNaN = pd.isnull(Data)
+            IsOk = ~ IsNaN
+            DateOk, DataOk, DateNaN = Dates[IsOk], Data[IsOk], Dates[IsNaN]
+            Trace = {'NbOk': len(DataOk), 'NbNaN': len(DateNaN), 'Sum': DataOk.sum()}
+            
+            Previous = Traces.get(Channel)
+            if not Previous is None:
+                DateOk = np.concatenate([Previous['DateOk'], DateOk])
+                DataOk = np.concatenate([Previous['DataOk'], DataOk])
+                DateNaN = np.concatenate([Previous['DateNaN'], DateNaN])
+                for Key in ['NbOk', 'NbNaN', 'Sum']:
+                    Trace[Key] += Previous[Key]
+            
+            Trace['DateOk'], Trace['DataOk'] = Decimate(DateOk, DataOk, MaxPoints)
+            #the NaN markers are plotted at a constant value: only their timestamps are decimated
+            Trace['DateNaN'], _ = Decimate(DateNaN, np.zeros(len(DateNaN)), MaxPoints)
+            Traces[Channel] = Trace
+    return Traces
+
+def Decimate(X, Y, MaxPoints):
+    #reduce a series to at most MaxPoints points before plotting, keeping the minimum and maximum of each bucket of consecutive points
+    #spikes and out of range values stay visible. Y must not contain NaN
+    if MaxPoints <= 0 or len(Y) <= MaxPoints:
+        return X, Y
+    
+    NbBuckets = max((MaxPoints - 2) // 2, 1)
+    BucketSize = -(-len(Y) // NbBuckets) #ceil
+    NbBuckets = -(-len(Y) // BucketSize)
+    #pad the last bucket with its last value, so that all the buckets have the same size
+    Padded = np.concatenate([Y, np.repeat(Y[-1:], NbBuckets * BucketSize - len(Y))]).reshape(NbBuckets, BucketSize)
+    Start = np.arange(NbBuckets) * BucketSize
+    #the first and last points are kept, so that the trace covers the whole period
+    Index = np.concatenate([[0, len(Y) - 1], Start + Padded.argmin(axis=1), Start + Padded.argmax(axis=1)])
+    Index = np.unique(np.minimum(Index, len(Y) - 1)) #sorted, without duplicates
+    return X[Index], Y[Index]
+
+def PlotMaxPoints(Group):
+    #maximum number of points per trace: column PlotMaxPoints of the config file if filled for the group, otherwise value of the ini file
+    if 'PlotMaxPoints' in Group.index and str(Group['PlotMaxPoints']).strip() != '':
+        return int(Group['PlotMaxPoints'])
+    else:
+        return Settings['PlotMaxPoints']
 
 #Main prog------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
-    Site, DateStart, DateEnd, YearsReport = GetInputArguments()
-    #Site, DateStart, DateEnd, YearsReport = None, None, None, None
-    
-    if not DateStart is None:
-        if DateEnd is None:
-            QC(Site, DateStart)
+    Sites, DateStart, DateEnd, YearsReport, NbWorkers, Interval, IsTriage = GetInputArguments()
+    #Sites, DateStart, DateEnd, YearsReport = None, None, None, None
+    
+    if not DateStart is None and IsTriage:
+        for Site in Sites:
+            Triage(Site, DateStart, DateEnd)
+    elif not DateStart is None:
+        if DateEnd is None and len(Sites) == 1:
+            #the data files of the day are spread over the workers
+            QC(Sites[0], DateStart, NbWorkers)
         else:
-            QC_n(Site, DateStart, DateEnd)
+            QC_Sites(Sites, DateStart, DateStart if DateEnd is None else DateEnd, NbWorkers)
             
     if not YearsReport is None:
-        ListReports(Site,YearsReport)
+        for Site in Sites:
+            ListReports(Site,YearsReport)
+    
+    if not Interval is None:
+        Watch(Sites, Interval, NbWorkers)
     
-    if (Site is None) and (DateStart is None) and (DateEnd is None) and (YearsReport is None):
+    if (Sites is None) and (DateStart is None) and (DateEnd is None) and (YearsReport is None) and (Interval is None):
         Site = 'GL-ZaF-L'
         QC(Site, date(2022,8,23))
         #QC_n(Site, date(2021,1,1), date(2021,12,31))